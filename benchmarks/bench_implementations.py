@@ -0,0 +1,141 @@
+# Benchmarks the reference matcher against the gemini-test implementations on
+# the same recorded clip, with DeepFace replaced by a deterministic stub.
+#
+#   python benchmarks/bench_implementations.py --clip session.mp4
+#   python benchmarks/bench_implementations.py --clip session.mp4 --save-baseline
+#
+# Exits non-zero when the reference is slower than the saved baseline by more
+# than --max-regression.
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RUNNER = Path(__file__).resolve().parent / 'run_implementation.py'
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+# The stub camera serves frames instantly, a capture thread would drop all but
+# the last one, so the reference reads the camera on its loop like the others
+SCRIPT_ARGS = {'reference': ['--grab-buffers', '0']}
+
+
+def implementations():
+    found = {'reference': ROOT / 'reference' / 'expression_matcher.py'}
+    for directory in sorted((ROOT / 'tests').glob('gemini-test*')):
+        for name in ('main.py', 'app.py'):
+            if (directory / name).exists():
+                found[directory.name] = directory / name
+    return found
+
+
+def run_one(script, clip, frames, stub_ms, trace_allocs, verbose, script_args=()):
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / 'result.json'
+        command = [sys.executable, str(RUNNER), '--script', str(script), '--clip', str(clip),
+                   '--frames', str(frames), '--stub-ms', str(stub_ms),
+                   '--workdir', str(Path(tmp) / 'work'), '--out', str(out)]
+        if trace_allocs:
+            command.append('--trace-allocs')
+        command += [f'--script-arg={arg}' for arg in script_args]
+        output = None if verbose else subprocess.DEVNULL
+        completed = subprocess.run(command, stdout=output, stderr=output)
+        if completed.returncode != 0 or not out.exists():
+            return None
+        return json.loads(out.read_text())
+
+
+def benchmark(names, clip, frames, stub_ms, verbose=False):
+    results = {}
+    for name, script in implementations().items():
+        if names and name not in names:
+            continue
+        print(f"Running {name}...", flush=True)
+        script_args = SCRIPT_ARGS.get(name, ())
+        timing = run_one(script, clip, frames, stub_ms, False, verbose, script_args)
+        if timing is None:
+            print(f"  {name} failed, rerun with --verbose to see its output")
+            continue
+        # Allocations are traced in a separate run so tracemalloc doesn't skew the timings
+        allocs = run_one(script, clip, frames, stub_ms, True, verbose, script_args)
+        if allocs is not None:
+            timing['alloc_mib_per_frame'] = allocs.get('alloc_mib_per_frame')
+        results[name] = timing
+    return results
+
+
+def print_table(results):
+    header = (f"{'implementation':<16}{'fps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'startup s':>11}{'calls':>7}{'rss MiB':>9}{'alloc MiB/f':>13}")
+    print()
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        alloc = r.get('alloc_mib_per_frame')
+        alloc_text = f"{alloc['mean']:.2f}" if alloc else '-'
+        startup = f"{r['startup_s']:.2f}" if r['startup_s'] is not None else '-'
+        print(f"{name:<16}{r['fps']:>8.1f}{r['latency_ms']['p50']:>9.2f}{r['latency_ms']['p95']:>9.2f}"
+              f"{r['latency_ms']['p99']:>9.2f}{startup:>11}{r['model_calls']:>7}"
+              f"{r['peak_rss_mib']:>9.0f}{alloc_text:>13}")
+
+
+def check_regression(current, baseline, max_regression):
+    failures = []
+    if current['fps'] < baseline['fps'] * (1 - max_regression):
+        failures.append(f"fps {current['fps']:.1f} vs baseline {baseline['fps']:.1f}")
+    if current['latency_ms']['p95'] > baseline['latency_ms']['p95'] * (1 + max_regression):
+        failures.append(f"p95 {current['latency_ms']['p95']:.2f} ms vs baseline "
+                        f"{baseline['latency_ms']['p95']:.2f} ms")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the expression matcher implementations")
+    parser.add_argument('--clip', required=True, help="recorded video played in place of the webcam")
+    parser.add_argument('--frames', type=int, default=300, help="frames per run, the clip loops if shorter")
+    parser.add_argument('--stub-ms', type=float, default=0.0,
+                        help="simulated DeepFace latency per call")
+    parser.add_argument('--only', action='append', help="run only these implementations")
+    parser.add_argument('--json', help="also write all results to this file")
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the reference results as the new baseline")
+    parser.add_argument('--max-regression', type=float, default=0.15,
+                        help="allowed fractional drop in fps or rise in p95 latency for the reference")
+    parser.add_argument('--verbose', action='store_true', help="show each implementation's output")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.only, args.clip, args.frames, args.stub_ms, args.verbose)
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+    reference = results.get('reference')
+    if reference is None:
+        return 0 if args.only and 'reference' not in args.only else 1
+
+    baseline_path = Path(args.baseline)
+    settings = {'frames': args.frames, 'stub_ms': args.stub_ms}
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({'settings': settings, 'reference': reference}, indent=2))
+        print(f"\nSaved reference baseline to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"\nNo baseline at {baseline_path}, run with --save-baseline to create one")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get('settings') != settings:
+        print(f"\nBaseline was recorded with {baseline.get('settings')}, not comparing")
+        return 0
+    failures = check_regression(reference, baseline['reference'], args.max_regression)
+    if failures:
+        print("\nReference regressed beyond {:.0%}: {}".format(args.max_regression, '; '.join(failures)))
+        return 1
+    print("\nReference is within {:.0%} of the baseline".format(args.max_regression))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# Measures what a lower inference resolution costs and saves. For every scale,
+# each clip frame gets a full face detection on a downscaled copy, the box is
+# mapped back and the emotion crop is cut from the full-resolution frame.
+# Results are compared with scale 1.0.
+#
+#   python benchmarks/bench_inference_resolution.py --clip session.mp4 --upscale 1920x1080
+#   python benchmarks/bench_inference_resolution.py --clip session.mp4 --scales 1,0.5,0.25 --stub
+import argparse
+import json
+import sys
+import time
+import types
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'reference'))
+
+
+def load_frames(path, count, size):
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if size is not None:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_CUBIC)
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        sys.exit(f"Could not read frames from {path}")
+    return frames
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    union = aw * ah + bw * bh - w * h
+    return w * h / union if union else 0.0
+
+
+def run_scale(frames, scale, model):
+    from emotion_model import dominant_emotion
+    from face_tracker import FaceTracker
+
+    tracker = FaceTracker(detect_scale=scale)
+    detect_ms, total_ms, results = [], [], []
+    for frame in frames:
+        start = time.perf_counter()
+        box = tracker.locate(frame)
+        detected = time.perf_counter()
+        scores = model.scores([tracker.crop(frame, box)])[0] if box is not None else None
+        detect_ms.append(1000 * (detected - start))
+        total_ms.append(1000 * (time.perf_counter() - start))
+        results.append((box, scores, dominant_emotion(scores) if scores else None))
+
+    # The live loop: tracking with a full detection every redetect_interval frames
+    tracker = FaceTracker(detect_scale=scale)
+    loop_ms = []
+    for frame in frames:
+        start = time.perf_counter()
+        tracker.update(frame)
+        loop_ms.append(1000 * (time.perf_counter() - start))
+    return detect_ms, total_ms, loop_ms, results
+
+
+def compare(results, reference):
+    found = [(r[0] is not None) == (f[0] is not None) for r, f in zip(results, reference)]
+    both = [(r, f) for r, f in zip(results, reference) if r[0] is not None and f[0] is not None]
+    return {
+        'face_agreement': float(np.mean(found)),
+        'box_iou': float(np.mean([iou(r[0], f[0]) for r, f in both])) if both else None,
+        'emotion_agreement': float(np.mean([r[2] == f[2] for r, f in both])) if both else None,
+        'score_diff': float(np.mean([np.mean([abs(r[1][k] - f[1][k]) for k in f[1]]) for r, f in both]))
+        if both else None,
+    }
+
+
+def percentiles(values):
+    p50, p95 = np.percentile(values, [50, 95])
+    return {'mean': float(np.mean(values)), 'p50': float(p50), 'p95': float(p95)}
+
+
+def print_table(rows):
+    header = (f"{'scale':>6}{'detect p50':>12}{'detect p95':>12}{'total p50':>11}{'loop mean':>11}"
+              f"{'loop p95':>10}{'faces':>8}{'IoU':>7}{'emotion':>9}{'score diff':>12}")
+    print()
+    print(header)
+    print('-' * len(header))
+
+    def pct(value):
+        return f"{100 * value:.0f}%" if value is not None else '-'
+
+    for row in rows:
+        a = row['agreement']
+        iou_text = f"{a['box_iou']:.2f}" if a['box_iou'] is not None else '-'
+        diff_text = f"{a['score_diff']:.2f}" if a['score_diff'] is not None else '-'
+        print(f"{row['scale']:>6.2f}{row['detect_ms']['p50']:>12.2f}{row['detect_ms']['p95']:>12.2f}"
+              f"{row['total_ms']['p50']:>11.2f}{row['loop_ms']['mean']:>11.2f}{row['loop_ms']['p95']:>10.2f}"
+              f"{pct(a['face_agreement']):>8}{iou_text:>7}{pct(a['emotion_agreement']):>9}{diff_text:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark face detection at lower inference resolutions")
+    parser.add_argument('--clip', required=True, help="recorded video to analyze")
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--upscale', metavar='WxH',
+                        help="resize clip frames to this size first, e.g. 1920x1080 to mimic a 1080p camera")
+    parser.add_argument('--scales', default='1.0,0.75,0.5,0.33,0.25')
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--stub', action='store_true',
+                        help="score faces with the deterministic DeepFace stub instead of the real model")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.stub:
+        import stub_deepface
+        deepface = types.ModuleType('deepface')
+        deepface.DeepFace = stub_deepface.DeepFace
+        sys.modules['deepface'] = deepface
+    from emotion_model import EmotionModel
+
+    size = tuple(int(v) for v in args.upscale.lower().split('x')) if args.upscale else None
+    frames = load_frames(args.clip, args.frames, size)
+    scales = [float(s) for s in args.scales.split(',')]
+    if 1.0 not in scales:
+        scales.insert(0, 1.0)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, scales {scales}")
+    model = EmotionModel(backend=args.emotion_backend)
+
+    runs = {scale: run_scale(frames, scale, model) for scale in scales}
+    reference = runs[1.0][3]
+    rows = []
+    for scale, (detect_ms, total_ms, loop_ms, results) in runs.items():
+        rows.append({'scale': scale, 'detect_ms': percentiles(detect_ms), 'total_ms': percentiles(total_ms),
+                     'loop_ms': percentiles(loop_ms), 'faces_found': sum(r[0] is not None for r in results),
+                     'agreement': compare(results, reference)})
+    print_table(rows)
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
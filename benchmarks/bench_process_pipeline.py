@@ -0,0 +1,104 @@
+# Runs reference/process_pipeline.py headless with 1, 2, 4... inference
+# workers on the same source and reports how rendering and inference
+# throughput scale.
+#
+#   python benchmarks/bench_process_pipeline.py --clip session.mp4 --workers 1,2,4
+#   python benchmarks/bench_process_pipeline.py --clip session.mp4 --stub-ms 40 --workers 1,2,4,8
+#
+# Inference only scales while there are free CPU cores for the workers. With
+# --stub-ms the stub model sleeps, which shows the pipeline's own scaling
+# on small machines. The clip needs a face, frames without one never reach
+# the model and aren't counted as inferences.
+import argparse
+import contextlib
+import functools
+import io
+import json
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'reference'))
+
+
+def install_stub(latency_ms):
+    # Runs in each worker process before the model is built
+    import stub_deepface
+    stub_deepface.latency_ms = latency_ms
+    deepface = types.ModuleType('deepface')
+    deepface.DeepFace = stub_deepface.DeepFace
+    sys.modules['deepface'] = deepface
+
+
+def run_one(source, workers, frames, source_fps, workdir, backend, stub_ms, inference_scale):
+    from frame_sinks import HeadlessSink
+    from process_pipeline import ProcessPipeline
+
+    pipeline = ProcessPipeline(source, workers=workers, loop=True, source_fps=source_fps, backend=backend,
+                               inference_scale=inference_scale,
+                               expression_mapping_file=str(workdir / 'expressions.json'),
+                               image_directory=str(workdir / 'images'), sink=HeadlessSink(),
+                               max_frames=frames,
+                               worker_init=functools.partial(install_stub, stub_ms) if stub_ms is not None else None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.run()
+    latency = pipeline.latency.summary() or {}
+    return {
+        'workers': workers,
+        'fps': pipeline.frames / pipeline.elapsed,
+        'inferences_per_s': pipeline.scored / pipeline.elapsed,
+        'latency_p50_ms': latency.get('p50_ms'),
+        'latency_p95_ms': latency.get('p95_ms'),
+        'skipped': pipeline.skipped,
+    }
+
+
+def print_table(rows):
+    header = f"{'workers':>8}{'fps':>8}{'inferences/s':>14}{'speedup':>9}{'p50 ms':>9}{'p95 ms':>9}"
+    print()
+    print(header)
+    print('-' * len(header))
+    base = rows[0]['inferences_per_s'] or 1.0
+    for row in rows:
+        p50 = f"{row['latency_p50_ms']:.1f}" if row['latency_p50_ms'] is not None else '-'
+        p95 = f"{row['latency_p95_ms']:.1f}" if row['latency_p95_ms'] is not None else '-'
+        print(f"{row['workers']:>8}{row['fps']:>8.1f}{row['inferences_per_s']:>14.1f}"
+              f"{row['inferences_per_s'] / base:>8.2f}x{p50:>9}{p95:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the multi-process pipeline as workers are added")
+    parser.add_argument('--clip', required=True, help="video with a face in it")
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--frames', type=int, default=600, help="rendered frames per run")
+    parser.add_argument('--source-fps', type=float, default=30.0,
+                        help="play the source back at camera speed, 0 for as fast as possible")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--stub-ms', type=float, default=None,
+                        help="use the deterministic DeepFace stub with this much latency per call")
+    parser.add_argument('--inference-scale', type=float, default=1.0)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    from run_implementation import prepare_workdir
+
+    source = str(Path(args.clip).resolve())
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        prepare_workdir(ROOT / 'reference' / 'expression_matcher.py', workdir)
+        for workers in (int(w) for w in args.workers.split(',')):
+            print(f"Running with {workers} worker(s)...", flush=True)
+            rows.append(run_one(source, workers, args.frames, args.source_fps or None, workdir,
+                                args.emotion_backend, args.stub_ms, args.inference_scale))
+    print_table(rows)
+    if not any(row['inferences_per_s'] for row in rows):
+        print(f"No face was found in {args.clip}, so the model never ran")
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
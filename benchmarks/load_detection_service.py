@@ -0,0 +1,153 @@
+# Load generator for reference/detection_server.py. Keeps --concurrency
+# keep-alive connections busy for --duration seconds and reports requests per
+# second, status codes and latency percentiles.
+#
+#   python reference/detection_server.py --emotion-backend onnx &
+#   python benchmarks/load_detection_service.py --image face.jpg --concurrency 32
+#
+# --rate switches from closed-loop (each connection sends as soon as its last
+# answer arrives) to a fixed total request rate, which is how overload and the
+# server's 503 responses show up. Latency is then measured from when each
+# request was due, so time spent waiting for a free connection counts too.
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+
+def load_payload(path, raw, face):
+    image = cv2.imread(path)
+    if image is None:
+        sys.exit(f"Could not read {path}")
+    height, width = image.shape[:2]
+    query = []
+    if raw:
+        body = image.tobytes()
+        content_type = 'application/octet-stream'
+        query += [f'width={width}', f'height={height}']
+    else:
+        body = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        content_type = 'image/jpeg'
+    if face:
+        query.append('face=1')
+    target = '/detect' + ('?' + '&'.join(query) if query else '')
+    return target, content_type, body
+
+
+async def send(reader, writer, host, target, content_type, body):
+    writer.write((f'POST {target} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split(' ')[1])
+    length = 0
+    for line in head[1:]:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':', 1)[1])
+    payload = json.loads(await reader.readexactly(length)) if length else {}
+    return status, payload
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.batches = []
+        self.failures = 0
+
+
+async def client(host, port, payload, deadline, results, tickets=None):
+    target, content_type, body = payload
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        due = None
+        if tickets is not None:
+            try:
+                due = await asyncio.wait_for(tickets.get(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            # A request sent late because every connection was busy still counts from when it was due
+            start = time.perf_counter() if due is None else due
+            status, answer = await send(reader, writer, host, target, content_type, body)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            results.failures += 1
+            writer = None
+            continue
+        results.statuses[status] += 1
+        if status == 200:
+            results.latencies.append(time.perf_counter() - start)
+            if answer.get('batch'):
+                results.batches.append(answer['batch'])
+    if writer is not None:
+        writer.close()
+
+
+async def issue_tickets(tickets, rate, deadline):
+    # Steady arrivals independent of how fast answers come back
+    interval = 1 / rate
+    next_time = time.perf_counter()
+    while next_time < deadline:
+        await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+        tickets.put_nowait(next_time)
+        next_time += interval
+
+
+async def run_load(host, port, payload, concurrency, duration, rate):
+    results = Results()
+    deadline = time.perf_counter() + duration
+    tickets = asyncio.Queue() if rate else None
+    tasks = [client(host, port, payload, deadline, results, tickets) for _ in range(concurrency)]
+    if rate:
+        tasks.append(issue_tickets(tickets, rate, deadline))
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed, rate=0):
+    total = sum(results.statuses.values())
+    ok = results.statuses.get(200, 0)
+    target = f" (target {rate:.1f})" if rate else ''
+    print(f"{total} requests in {elapsed:.1f} s: {total / elapsed:.1f} req/s sent{target}, "
+          f"{ok / elapsed:.1f} req/s answered")
+    if rate and total / elapsed < 0.95 * rate:
+        # Either the server is saturated or --concurrency is too low to keep up
+        print(f"Warning: only {total / elapsed:.1f} of {rate:.1f} req/s were sent, requests waited "
+              f"for a free connection and that wait is in the latencies")
+    print(f"Status codes: {dict(sorted(results.statuses.items()))}, connection failures: {results.failures}")
+    if results.latencies:
+        p50, p95, p99 = np.percentile(results.latencies, [50, 95, 99]) * 1000
+        print(f"Latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, "
+              f"max {1000 * max(results.latencies):.1f} ms")
+    if results.batches:
+        print(f"Mean batch size seen by requests: {np.mean(results.batches):.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the expression detection service')
+    parser.add_argument('--image', required=True, help='frame or face photo to send')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=0, help='total requests per second, 0 for closed-loop')
+    parser.add_argument('--raw', action='store_true', help='send raw BGR pixels instead of JPEG')
+    parser.add_argument('--face', action='store_true', help='the image is already a face crop, skip detection')
+    args = parser.parse_args(argv)
+
+    payload = load_payload(args.image, args.raw, args.face)
+    results, elapsed = asyncio.run(run_load(args.host, args.port, payload, args.concurrency,
+                                            args.duration, args.rate))
+    report(results, elapsed, args.rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# Runs one implementation against a recorded clip with the camera, the window
+# and DeepFace replaced, and writes its timings as JSON. Started as a
+# subprocess by bench_implementations.py so every run gets a fresh interpreter.
+import argparse
+import json
+import os
+import resource
+import runpy
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import stub_deepface
+
+
+def load_clip(path, frames):
+    cap = cv2.VideoCapture(str(path))
+    clip = []
+    while len(clip) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        clip.append(frame)
+    cap.release()
+    if not clip:
+        raise SystemExit(f"Could not read frames from {path}")
+    return clip
+
+
+class ClipCapture:
+    # Stands in for cv2.VideoCapture(0), loops the clip until `frames` are served
+    clip = []
+    frames = 0
+
+    def __init__(self, *args, **kwargs):
+        self.served = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self, image=None):
+        if self.served >= self.frames:
+            return False, None
+        frame = self.clip[self.served % len(self.clip)].copy()
+        self.served += 1
+        return True, frame
+
+    def set(self, prop, value):
+        return True
+
+    def get(self, prop):
+        return 0.0
+
+    def release(self):
+        pass
+
+
+class Recorder:
+    def __init__(self, trace_allocs):
+        self.trace_allocs = trace_allocs
+        self.show_times = []
+        self.alloc_bytes = []
+        self.frame_start_memory = 0
+
+    def imshow(self, name, frame):
+        self.show_times.append(time.perf_counter())
+        if self.trace_allocs:
+            # Bytes allocated during the frame on top of what was live at its start
+            current, peak = tracemalloc.get_traced_memory()
+            self.alloc_bytes.append(peak - self.frame_start_memory)
+            tracemalloc.reset_peak()
+            self.frame_start_memory = current
+
+
+def prepare_workdir(script, workdir):
+    # The implementation's expressions.json plus a placeholder for every image it names
+    workdir.mkdir(parents=True, exist_ok=True)
+    mapping = json.loads((script.parent / 'expressions.json').read_text())
+    (workdir / 'expressions.json').write_text(json.dumps(mapping))
+    (workdir / 'images').mkdir(exist_ok=True)
+    for i, names in enumerate(mapping.values()):
+        for name in names:
+            image = np.full((1024, 768, 3), (60 + 40 * i) % 256, dtype=np.uint8)
+            cv2.putText(image, name, (40, 512), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+            cv2.imwrite(str(workdir / 'images' / name.strip()), image)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--script', required=True)
+    parser.add_argument('--clip', required=True)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--stub-ms', type=float, default=0.0)
+    parser.add_argument('--workdir', required=True)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--trace-allocs', action='store_true')
+    parser.add_argument('--script-arg', action='append', default=[],
+                        help="command-line argument for the script, e.g. --script-arg=--grab-buffers")
+    args = parser.parse_args()
+
+    script = Path(args.script).resolve()
+    clip_path = Path(args.clip).resolve()
+    out_path = Path(args.out).resolve()
+    prepare_workdir(script, Path(args.workdir))
+
+    ClipCapture.clip = load_clip(clip_path, args.frames)
+    ClipCapture.frames = args.frames
+    recorder = Recorder(args.trace_allocs)
+
+    stub_deepface.latency_ms = args.stub_ms
+    deepface = types.ModuleType('deepface')
+    deepface.DeepFace = stub_deepface.DeepFace
+    sys.modules['deepface'] = deepface
+
+    cv2.VideoCapture = ClipCapture
+    cv2.imshow = recorder.imshow
+    cv2.waitKey = lambda delay=0: -1
+    cv2.namedWindow = lambda *a, **k: None
+    cv2.destroyAllWindows = lambda: None
+
+    os.chdir(args.workdir)
+    sys.path.insert(0, str(script.parent))
+    sys.argv = [str(script)] + args.script_arg
+
+    if args.trace_allocs:
+        tracemalloc.start()
+    start = time.perf_counter()
+    runpy.run_path(str(script), run_name='__main__')
+    end = time.perf_counter()
+    if args.trace_allocs:
+        tracemalloc.stop()
+
+    times = recorder.show_times
+    deltas = np.diff(times) * 1000 if len(times) > 1 else np.zeros(1)
+    result = {
+        'frames': len(times),
+        'fps': (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 0.0,
+        'latency_ms': {
+            'p50': float(np.percentile(deltas, 50)),
+            'p95': float(np.percentile(deltas, 95)),
+            'p99': float(np.percentile(deltas, 99)),
+            'max': float(deltas.max()),
+        },
+        'startup_s': (times[0] - start) if times else None,
+        'total_s': end - start,
+        'model_calls': stub_deepface.calls,
+        'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if args.trace_allocs and recorder.alloc_bytes:
+        # The first frame includes startup allocations
+        per_frame = np.array(recorder.alloc_bytes[1:] or recorder.alloc_bytes) / 2 ** 20
+        result['alloc_mib_per_frame'] = {'mean': float(per_frame.mean()),
+                                         'p95': float(np.percentile(per_frame, 95))}
+    out_path.write_text(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
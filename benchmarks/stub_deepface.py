@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+# Simulated model latency per call, set by the runner
+latency_ms = 0.0
+calls = 0
+
+
+def _wait():
+    global calls
+    calls += 1
+    if latency_ms:
+        time.sleep(latency_ms / 1000.0)
+
+
+def _probabilities(image):
+    # Deterministic: the winning class follows the image brightness
+    probabilities = np.full(len(EMOTION_LABELS), 0.05, dtype=np.float32)
+    probabilities[int(np.asarray(image).mean()) // 8 % len(EMOTION_LABELS)] = 0.7
+    return probabilities
+
+
+class _EmotionNetwork:
+    def __call__(self, batch, training=False):
+        _wait()
+        return np.stack([_probabilities(sample) for sample in batch])
+
+
+class _EmotionClient:
+    def __init__(self):
+        self.model = _EmotionNetwork()
+
+
+class DeepFace:
+    @staticmethod
+    def analyze(img_path, actions=('emotion',), enforce_detection=True, detector_backend='opencv',
+                silent=False, **kwargs):
+        _wait()
+        probabilities = _probabilities(img_path)
+        scores = {label: float(p) * 100 for label, p in zip(EMOTION_LABELS, probabilities)}
+        h, w = np.asarray(img_path).shape[:2]
+        return [{'emotion': scores, 'dominant_emotion': max(scores, key=scores.get),
+                 'region': {'x': 0, 'y': 0, 'w': w, 'h': h}, 'face_confidence': 1.0}]
+
+    @staticmethod
+    def build_model(model_name=None, task=None):
+        return _EmotionClient()
@@ -0,0 +1,64 @@
+import time
+
+import cv2
+
+
+class AnalysisScheduler:
+    # Decides when a frame is worth sending to the model: when the scene has
+    # changed enough since the last analysis, but never more often than
+    # min_interval_ms and never less often than max_interval_ms
+    def __init__(self, change_threshold=6.0, min_interval_ms=100, max_interval_ms=1000,
+                 probe_size=(32, 24)):
+        self.change_threshold = change_threshold
+        self.min_interval = min_interval_ms / 1000.0
+        self.max_interval = max_interval_ms / 1000.0
+        self.probe_size = probe_size
+        self.reference = None
+        self.last_analysis = None
+        self.last_change = 0.0
+        self.motion_triggers = 0
+        self.timeout_triggers = 0
+        self.skipped = 0
+
+    def probe(self, frame):
+        small = cv2.resize(frame, self.probe_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_analyze(self, frame, now=None):
+        now = time.perf_counter() if now is None else now
+
+        if self.last_analysis is None:
+            self._trigger(self.probe(frame), now)
+            self.timeout_triggers += 1
+            return True
+
+        elapsed = now - self.last_analysis
+        if elapsed < self.min_interval:
+            self.skipped += 1
+            return False
+
+        probe = self.probe(frame)
+        if elapsed >= self.max_interval:
+            self._trigger(probe, now)
+            self.timeout_triggers += 1
+            return True
+
+        # Mean absolute difference against the last analyzed frame, 0-255
+        self.last_change = float(cv2.absdiff(probe, self.reference).mean())
+        if self.last_change >= self.change_threshold:
+            self._trigger(probe, now)
+            self.motion_triggers += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def _trigger(self, probe, now):
+        self.reference = probe
+        self.last_analysis = now
+
+    def summary(self):
+        return (f"Analyses: {self.motion_triggers} on motion, {self.timeout_triggers} on max interval, "
+                f"{self.skipped} frames skipped")
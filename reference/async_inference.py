@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import deque
+
+
+class AsyncExpressionWorker:
+    def __init__(self, detect_fn):
+        self.detect_fn = detect_fn
+        self._cond = threading.Condition()
+        self._pending = None
+        self._result = None
+        self._running = False
+        self._thread = None
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='expression-worker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, frame, timestamp):
+        # Only the newest frame is kept, anything still waiting is stale
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (frame, timestamp)
+            self.submitted += 1
+            self._cond.notify()
+
+    def latest(self):
+        # (expression, source frame timestamp, result number) or None
+        with self._cond:
+            return self._result
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._pending is None and self._running:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                frame, timestamp = self._pending
+                self._pending = None
+
+            expression = self.detect_fn(frame)
+
+            with self._cond:
+                self.completed += 1
+                self._result = (expression, timestamp, self.completed)
+
+
+class LatencyTracker:
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+
+    def record(self, source_timestamp):
+        self.samples.append(time.perf_counter() - source_timestamp)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return {
+            'count': len(ordered),
+            'mean_ms': 1000 * sum(ordered) / len(ordered),
+            'p50_ms': 1000 * ordered[len(ordered) // 2],
+            'p95_ms': 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max_ms': 1000 * ordered[-1],
+        }
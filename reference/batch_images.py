@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import cv2
+
+from emotion_model import EMOTION_LABELS, EmotionModel, dominant_emotion
+from face_detectors import create_detector, detector_names
+from face_tracker import FaceTracker
+from result_cache import ImageResultStore, content_hash
+
+IMAGE_SUFFIXES = ['.png', '.jpg', '.jpeg']
+
+_model = None
+_tracker = None
+
+
+def _init_worker(backend, inference_scale=1.0, detector='haar'):
+    # One model per worker process, loaded once
+    global _model, _tracker
+    _model = EmotionModel(backend=backend)
+    _tracker = FaceTracker(detect_scale=inference_scale, detector=create_detector(detector))
+
+
+def find_images(directory):
+    directory = Path(directory)
+    if not directory.is_dir():
+        raise ValueError(f"Not a directory: {directory}")
+    return sorted(p for p in directory.rglob('*') if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def classify_chunk(items, batch_size, no_face):
+    # items are (content hash, path) pairs, returns content hash -> result
+    results, faces, pending = {}, [], []
+
+    def flush():
+        for key, scores in zip(pending, _model.scores(faces)):
+            results[key]['scores'] = scores
+            results[key]['expression'] = dominant_emotion(scores)
+        faces.clear()
+        pending.clear()
+
+    for key, path in items:
+        image = cv2.imread(str(path))
+        if image is None:
+            results[key] = {'face': None, 'expression': None, 'scores': None, 'error': 'unreadable'}
+            continue
+        results[key] = {'face': None, 'expression': None, 'scores': None, 'error': None}
+        box = _tracker.locate(image)
+        if box is not None:
+            results[key]['face'] = [int(v) for v in box]
+            faces.append(_tracker.crop(image, box))
+        elif no_face == 'whole':
+            # Like DeepFace.analyze without enforce_detection, the whole image is the face
+            faces.append(image)
+        else:
+            continue
+        pending.append(key)
+        if len(faces) == batch_size:
+            flush()
+    if faces:
+        flush()
+    return results
+
+
+def run_batch(directory, store, workers=None, batch_size=16, chunk_images=64, backend='keras',
+              inference_scale=1.0, detector='haar', no_face='whole'):
+    if backend != 'keras':
+        # Fail here rather than once in every worker
+        from emotion_backends import require_quantized_model
+        require_quantized_model(backend)
+    directory = Path(directory)
+    paths = find_images(directory)
+    start = time.perf_counter()
+
+    # Hashing is disk bound and hashlib releases the GIL, so threads are enough
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        hashes = list(pool.map(content_hash, paths))
+    by_hash = {}
+    for key, path in zip(hashes, paths):
+        by_hash.setdefault(key, path)
+
+    settings = f"{backend}|{detector}|scale {inference_scale}|no face {no_face}"
+    results = store.lookup(by_hash, settings)
+    todo = [(key, path) for key, path in by_hash.items() if key not in results]
+    cached = len(by_hash) - len(todo)
+    chunks = [todo[i:i + chunk_images] for i in range(0, len(todo), chunk_images)]
+    workers = min(workers or os.cpu_count(), max(1, len(chunks)))
+
+    # Unreadable files are stored too, the same bytes won't decode next time either
+    def collect(part):
+        results.update(part)
+        store.store(part, settings)
+
+    if workers == 1 and chunks:
+        _init_worker(backend, inference_scale, detector)
+        for chunk in chunks:
+            collect(classify_chunk(chunk, batch_size, no_face))
+    elif chunks:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(backend, inference_scale, detector)) as pool:
+            futures = [pool.submit(classify_chunk, chunk, batch_size, no_face) for chunk in chunks]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    records = []
+    for key, path in zip(hashes, paths):
+        result = results[key]
+        records.append({'image': path.relative_to(directory).as_posix(), 'content_hash': key,
+                        'face': result['face'], 'expression': result['expression'],
+                        'scores': result['scores'], 'error': result.get('error')})
+    elapsed = time.perf_counter() - start
+    on_workers = f" on {workers} worker(s)" if chunks else ''
+    print(f"Classified {len(paths)} images in {elapsed:.1f} s: {len(todo)} new{on_workers}, "
+          f"{cached} from the cache, {len(paths) - len(by_hash)} duplicates")
+    return records
+
+
+def build_mapping(records, min_score=0.0):
+    # Every expression with its images, the most expressive first
+    mapping = {label: [] for label in EMOTION_LABELS}
+    for record in sorted(records, key=lambda r: -(r['scores'] or {}).get(r['expression'], 0)):
+        if record['expression'] is not None and record['scores'][record['expression']] >= min_score:
+            mapping[record['expression']].append(record['image'])
+    return mapping
+
+
+def audit_mapping(records, mapping):
+    # Images an existing mapping files under a different expression than the model sees
+    by_image = {r['image']: r for r in records}
+    disagreements = []
+    for expression, images in mapping.items():
+        for image in images:
+            record = by_image.get(image)
+            if record is not None and record['expression'] is not None and record['expression'] != expression:
+                disagreements.append((image, expression, record['expression'],
+                                      record['scores'][record['expression']]))
+    return disagreements
+
+
+def write_scores(records, path):
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['image', 'content_hash', 'face_x', 'face_y', 'face_w', 'face_h', 'expression',
+                             'error'] + EMOTION_LABELS)
+            for r in records:
+                face = r['face'] or ['', '', '', '']
+                scores = [round(r['scores'][label], 4) if r['scores'] else '' for label in EMOTION_LABELS]
+                writer.writerow([r['image'], r['content_hash'], *face, r['expression'] or '', r['error'] or '']
+                                + scores)
+    else:
+        with open(path, 'w') as f:
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify the expressions in a folder of still images")
+    parser.add_argument('directory', help="searched recursively for .png, .jpg and .jpeg files")
+    parser.add_argument('--mapping-out', default='expressions.generated.json',
+                        help="generated expression mapping, image paths relative to the directory")
+    parser.add_argument('--scores-out', default='image_scores.csv', help="per-image scores, .csv or .jsonl")
+    parser.add_argument('--cache', default='image_results.sqlite',
+                        help="SQLite file with results by content hash, unchanged files are skipped on rerun")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, default one per core")
+    parser.add_argument('--chunk-images', type=int, default=64, help="images per work item")
+    parser.add_argument('--batch-size', type=int, default=16, help="face crops per model call")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--detector', choices=detector_names(), default='haar')
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="find faces on a copy downscaled by this factor, crops still come from the full image")
+    parser.add_argument('--no-face', choices=['whole', 'skip'], default='whole',
+                        help="classify the whole image when no face is found, or leave it out")
+    parser.add_argument('--min-score', type=float, default=0.0,
+                        help="only map images whose dominant expression scores at least this many percent")
+    parser.add_argument('--audit', metavar='MAPPING',
+                        help="list images this mapping file puts under a different expression")
+    args = parser.parse_args(argv)
+
+    store = ImageResultStore(args.cache)
+    try:
+        records = run_batch(args.directory, store, args.workers, args.batch_size, args.chunk_images,
+                            args.emotion_backend, args.inference_scale, args.detector, args.no_face)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error: {e}")
+        return
+    finally:
+        print(store.summary())
+        store.close()
+
+    errors = [r for r in records if r['error']]
+    if errors:
+        print(f"{len(errors)} image(s) could not be read, e.g. {errors[0]['image']}")
+    no_face = sum(r['expression'] is None and not r['error'] for r in records)
+    if no_face:
+        print(f"{no_face} image(s) without a face were left out")
+
+    write_scores(records, args.scores_out)
+    print(f"Wrote {args.scores_out}")
+    mapping = build_mapping(records, args.min_score)
+    with open(args.mapping_out, 'w') as f:
+        json.dump(mapping, f, indent=2)
+    print(f"Wrote {args.mapping_out}: " + ', '.join(f"{label} {len(images)}" for label, images in mapping.items()))
+
+    if args.audit:
+        with open(args.audit) as f:
+            existing = json.load(f)
+        disagreements = audit_mapping(records, existing)
+        print(f"{args.audit}: {len(disagreements)} image(s) classified differently")
+        for image, mapped, classified, score in disagreements:
+            print(f"  {image}: mapped to {mapped}, classified as {classified} ({score:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
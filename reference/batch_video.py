@@ -0,0 +1,220 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+
+from emotion_model import EMOTION_LABELS, EmotionModel, dominant_emotion
+from expression_smoother import ExpressionSmoother
+from face_tracker import FaceTracker
+
+_model = None
+_tracker = None
+
+
+def _init_worker(backend, inference_scale=1.0):
+    # One model per worker process, loaded once
+    global _model, _tracker
+    _model = EmotionModel(backend=backend)
+    _tracker = FaceTracker(detect_scale=inference_scale)
+
+
+def video_info(path):
+    # The frame count is the container's estimate, 0 when it has none
+    cap = cv2.VideoCapture(str(path))
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video file: {path}")
+    frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    return frames, fps
+
+
+def plan_chunks(frame_count, interval, batch_size, chunk_frames):
+    # Chunk boundaries fall on whole model batches of analyzed frames, so every
+    # batch holds the same frames no matter how many workers run. The last
+    # chunk reads to the end of the file, past the estimated frame count.
+    step = interval * batch_size
+    chunk_frames = max(step, math.ceil(chunk_frames / step) * step)
+    starts = list(range(0, frame_count, chunk_frames)) or [0]
+    return [(start, start + chunk_frames) for start in starts[:-1]] + [(starts[-1], None)]
+
+
+def process_chunk(path, start, end, interval, fps, batch_size):
+    # Every analyzed frame gets a full face detection, nothing is carried over
+    # from earlier frames, so results don't depend on where a chunk starts.
+    # end None reads to the end of the file. Returns the records and the
+    # number of frames read.
+    cap = cv2.VideoCapture(str(path))
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    records, faces, pending = [], [], []
+
+    def flush():
+        for record, scores in zip(pending, _model.scores(faces)):
+            record['scores'] = scores
+            record['expression'] = dominant_emotion(scores)
+        faces.clear()
+        pending.clear()
+
+    for index in itertools.count(start):
+        if index == end:
+            break
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % interval:
+            continue
+        record = {'frame': index, 'time_s': round(index / fps, 3), 'face': None,
+                  'expression': None, 'scores': None}
+        records.append(record)
+        box = _tracker.locate(frame)
+        if box is not None:
+            record['face'] = list(box)
+            faces.append(_tracker.crop(frame, box))
+            pending.append(record)
+        if len(records) % batch_size == 0 and faces:
+            flush()
+    if faces:
+        flush()
+    cap.release()
+    return records, index - start
+
+
+def smooth_timeline(records, smoother):
+    # The displayed expression, as the live matcher would have shown it
+    for record in records:
+        if record['scores'] is not None:
+            smoother.update(record['scores'], record['time_s'])
+        record['displayed'] = smoother.current
+    return records
+
+
+def write_timeline(records, path):
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time_s', 'face_x', 'face_y', 'face_w', 'face_h',
+                             'expression', 'displayed'] + EMOTION_LABELS)
+            for r in records:
+                face = r['face'] or ['', '', '', '']
+                scores = [round(r['scores'][label], 4) if r['scores'] else '' for label in EMOTION_LABELS]
+                writer.writerow([r['frame'], r['time_s'], *face, r['expression'] or '', r['displayed']] + scores)
+    else:
+        with open(path, 'w') as f:
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+
+
+def write_composite(video_path, records, output_path, fps, mapping_file, image_directory):
+    from expression_matcher import ExpressionMatcher
+    from frame_sinks import HeadlessSink
+    from frame_sources import VideoFileSource
+
+    matcher = ExpressionMatcher(mapping_file, image_directory, source=VideoFileSource(video_path),
+                                sink=HeadlessSink(), load_model=False)
+    by_frame = {r['frame']: r for r in records}
+    writer = None
+    index = 0
+    while True:
+        ret, frame = matcher.source.read()
+        if not ret:
+            break
+        record = by_frame.get(index)
+        if record is not None:
+            matcher.set_expression(record['displayed'])
+        char_name = matcher.get_image_name_for_expression(matcher.current_expression)
+        display = matcher.compositor.compose(frame, matcher.current_expression, char_name,
+                                             matcher.load_image(char_name))
+        if writer is None:
+            writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                     (display.shape[1], display.shape[0]))
+        writer.write(display)
+        index += 1
+    matcher.source.release()
+    if writer is not None:
+        writer.release()
+
+
+def run_batch(video, workers=None, interval=1, batch_size=16, chunk_frames=300, backend='keras',
+              inference_scale=1.0):
+    if backend != 'keras':
+        # Fail here rather than once in every worker
+        from emotion_backends import require_quantized_model
+        require_quantized_model(backend)
+    frame_count, fps = video_info(video)
+    workers = workers or os.cpu_count()
+    if frame_count == 0 and workers > 1:
+        print(f"{video} has no frame count, reading it sequentially on one worker")
+        workers = 1
+    # One worker reads the whole file front to back, without seeking
+    chunks = [(0, None)] if workers == 1 else plan_chunks(frame_count, interval, batch_size, chunk_frames)
+    start = time.perf_counter()
+
+    if workers == 1:
+        _init_worker(backend, inference_scale)
+        parts = [process_chunk(video, s, e, interval, fps, batch_size) for s, e in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(backend, inference_scale)) as pool:
+            futures = [pool.submit(process_chunk, video, s, e, interval, fps, batch_size)
+                       for s, e in chunks]
+            parts = [future.result() for future in futures]
+
+    # A chunk that stops short before one that read frames means seeking failed,
+    # chunks past the end of the file only mean the estimate was too high
+    ends = [s + read for (s, _), (_, read) in zip(chunks, parts)]
+    frame_count = max([end for end, (_, read) in zip(ends, parts) if read] or [0])
+    for (_, chunk_end), end in zip(chunks[:-1], ends):
+        if end < chunk_end and end < frame_count:
+            print(f"Warning: frames {end}-{chunk_end - 1} could not be read, rerun with --workers 1")
+    records = [record for part, _ in parts for record in part]
+    elapsed = time.perf_counter() - start
+    print(f"Analyzed {len(records)} of {frame_count} frames in {len(chunks)} chunks on {workers} "
+          f"worker(s): {elapsed:.1f} s, {frame_count / elapsed:.1f} video frames/s")
+    return records, fps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a recorded video with the expression matcher")
+    parser.add_argument('video')
+    parser.add_argument('--output', default='timeline.jsonl', help="timeline file, .jsonl or .csv")
+    parser.add_argument('--video-out', help="also write the composited view to this video file")
+    parser.add_argument('--interval', type=int, default=1, help="analyze every Nth frame")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, default one per core")
+    parser.add_argument('--chunk-frames', type=int, default=300, help="frames per work item")
+    parser.add_argument('--batch-size', type=int, default=16, help="face crops per model call")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="find faces on a copy downscaled by this factor, crops still come from the full frame")
+    parser.add_argument('--mapping', default='expressions.json')
+    parser.add_argument('--images', default='images')
+    args = parser.parse_args(argv)
+    if args.interval < 1:
+        parser.error("--interval must be at least 1")
+
+    try:
+        records, fps = run_batch(args.video, args.workers, args.interval, args.batch_size,
+                                 args.chunk_frames, args.emotion_backend, args.inference_scale)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error: {e}")
+        return
+
+    smooth_timeline(records, ExpressionSmoother())
+    write_timeline(records, args.output)
+    print(f"Wrote {args.output}")
+
+    if args.video_out:
+        write_composite(args.video, records, args.video_out, fps, args.mapping, args.images)
+        print(f"Wrote {args.video_out}")
+
+
+if __name__ == "__main__":
+    main()
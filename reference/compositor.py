@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+from image_atlas import ByteBudgetLRU
+
+
+class Compositor:
+    def __init__(self, bar_height=50, buffers=2, pane_cache_bytes=64 * 2 ** 20):
+        self.bar_height = bar_height
+        self.pane_cache = ByteBudgetLRU(pane_cache_bytes)
+        self.canvases = [None] * buffers
+        self.static_content = [None] * buffers
+        self.index = 0
+
+    def character_pane(self, image_key, image, height):
+        # Resized character images are cached per (image, target height)
+        key = (image_key, height)
+        pane = self.pane_cache.get(key)
+        if pane is not None:
+            return pane
+
+        if image is not None:
+            width = int(height * image.shape[1] / image.shape[0])
+            pane = cv2.resize(image, (width, height))
+        else:
+            width = int(height * 0.75)
+            pane = np.full((height, width, 3), (220, 220, 220), dtype=np.uint8)
+            cv2.putText(pane, "No image", (width // 4, height // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 100, 100), 2)
+        self.pane_cache[key] = pane
+        return pane
+
+    def compose(self, frame, expression, image_key, image, status=None):
+        h, w = frame.shape[:2]
+        pane = self.character_pane(image_key, image, h)
+        shape = (h + self.bar_height, w + pane.shape[1], 3)
+
+        # Alternate between canvases so the previously returned frame stays intact
+        self.index = (self.index + 1) % len(self.canvases)
+        canvas = self.canvases[self.index]
+        if canvas is None or canvas.shape != shape:
+            canvas = np.zeros(shape, dtype=np.uint8)
+            self.canvases[self.index] = canvas
+            self.static_content[self.index] = None
+
+        canvas[0:h, 0:w] = frame
+
+        # Character pane and bottom bar only change with the expression
+        static_key = (expression, image_key, h, status)
+        if self.static_content[self.index] != static_key:
+            canvas[0:h, w:] = pane
+            canvas[h:] = 0
+            text = status if status is not None else f"Expression: {expression.capitalize()}"
+            cv2.putText(canvas, text,
+                        (20, h + 35), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            self.static_content[self.index] = static_key
+
+        return canvas
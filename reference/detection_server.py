@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+from emotion_model import EmotionModel, dominant_emotion
+from face_tracker import FaceTracker
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_frame(body, content_type, query):
+    # JPEG/PNG bodies are decoded, raw bodies are BGR (or gray) pixels of the
+    # size given in the query string
+    if content_type in ('image/jpeg', 'image/png'):
+        frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise RequestError(400, 'could not decode image')
+        return frame
+
+    if content_type == 'application/octet-stream':
+        try:
+            width = int(query['width'][0])
+            height = int(query['height'][0])
+        except (KeyError, ValueError):
+            raise RequestError(400, 'raw frames need width and height in the query string')
+        if width <= 0 or height <= 0:
+            raise RequestError(400, f'{width}x{height} is not a frame size')
+        channels = len(body) // max(1, width * height)
+        if channels not in (1, 3) or width * height * channels != len(body):
+            raise RequestError(400, f'{len(body)} bytes is not a {width}x{height} gray or BGR frame')
+        frame = np.frombuffer(body, dtype=np.uint8).reshape(height, width, channels)
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if channels == 1 else frame
+
+    raise RequestError(400, f'unsupported content type {content_type!r}')
+
+
+class DetectionService:
+    # Frames are decoded and searched for a face on a thread pool. The face
+    # crops of concurrent requests are gathered into micro-batches and scored
+    # by a small pool of inference threads that share one model.
+    def __init__(self, model, prep_workers=4, inference_workers=1, max_batch=16,
+                 max_wait_ms=5, max_pending=64, inference_scale=1.0):
+        self.model = model
+        self.prep_pool = ThreadPoolExecutor(prep_workers, thread_name_prefix='detect-prep')
+        self.inference_pool = ThreadPoolExecutor(inference_workers, thread_name_prefix='detect-infer')
+        self.inference_workers = inference_workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.inference_scale = inference_scale
+        self.trackers = threading.local()
+        self.pending = 0
+        self.queue = None
+        self.slots = None
+        self.batcher = None
+        self.running_batches = set()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.no_face = 0
+        self.batch_sizes = Counter()
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.inference_workers)
+        self.batcher = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self.batcher is not None:
+            self.batcher.cancel()
+        if self.running_batches:
+            await asyncio.gather(*self.running_batches, return_exceptions=True)
+        self.prep_pool.shutdown()
+        self.inference_pool.shutdown()
+
+    def overloaded(self):
+        return self.pending >= self.max_pending
+
+    def prepare(self, body, content_type, query):
+        frame = decode_frame(body, content_type, query)
+        # Callers that already cropped the face can skip detection
+        if query.get('face', ['0'])[0] == '1':
+            return None, frame
+
+        tracker = getattr(self.trackers, 'tracker', None)
+        if tracker is None:
+            tracker = self.trackers.tracker = FaceTracker(detect_scale=self.inference_scale)
+        box = tracker.locate(frame)
+        if box is None:
+            return None, None
+        return box, tracker.crop(frame, box)
+
+    async def detect(self, body, content_type, query):
+        loop = asyncio.get_running_loop()
+        self.requests += 1
+        self.pending += 1
+        try:
+            start = time.perf_counter()
+            box, face = await loop.run_in_executor(self.prep_pool, self.prepare, body, content_type, query)
+            if face is None:
+                self.no_face += 1
+                return {'face': None, 'scores': None, 'dominant': None,
+                        'ms': 1000 * (time.perf_counter() - start)}
+
+            future = loop.create_future()
+            self.queue.put_nowait((face, future))
+            scores, batch_size = await future
+            return {'face': list(box) if box is not None else None, 'scores': scores,
+                    'dominant': dominant_emotion(scores), 'batch': batch_size,
+                    'ms': 1000 * (time.perf_counter() - start)}
+        finally:
+            self.pending -= 1
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                # Take what is already waiting, then hold the batch open a
+                # little longer for requests that are still being decoded
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.slots.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self.running_batches.add(task)
+            task.add_done_callback(self.running_batches.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            faces = [face for face, _ in batch]
+            results = await loop.run_in_executor(self.inference_pool, self.model.scores, faces)
+            self.batch_sizes[len(batch)] += 1
+            for (_, future), scores in zip(batch, results):
+                if not future.done():
+                    future.set_result(({e: float(s) for e, s in scores.items()}, len(batch)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        faces = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'no_face': self.no_face,
+            'pending': self.pending,
+            'batches': batches,
+            'mean_batch': faces / batches if batches else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"Detection service: {s['requests']} requests, {s['rejected']} rejected as overloaded, "
+                f"{s['errors']} errors, {s['no_face']} without a face, {s['batches']} batches "
+                f"(mean size {s['mean_batch']:.1f}, sizes {s['batch_sizes']})")
+
+
+async def read_request(reader, max_body):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > max_body:
+        raise RequestError(413, f'body larger than {max_body} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, version, headers, body
+
+
+def write_response(writer, status, payload, keep_alive, extra_headers=()):
+    body = json.dumps(payload).encode()
+    head = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    head.extend(extra_headers)
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+
+
+class DetectionServer:
+    def __init__(self, service, host='127.0.0.1', port=8765, max_body_mb=16):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.max_body = int(max_body_mb * 2**20)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, target, version, headers, body = await self.read(reader)
+                except RequestError as e:
+                    write_response(writer, e.status, {'error': str(e)}, False)
+                    break
+                if method is None:
+                    break
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                status, payload, extra = await self.route(method, target, headers, body)
+                write_response(writer, status, payload, keep_alive, extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def read(self, reader):
+        try:
+            return await read_request(reader, self.max_body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None, None, None, None, None
+        except (ValueError, asyncio.LimitOverrunError):
+            raise RequestError(400, 'malformed request')
+
+    async def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'backend': self.service.model.backend, **self.service.stats()}, ()
+        if url.path != '/detect':
+            return 404, {'error': f'unknown path {url.path}'}, ()
+        if method != 'POST':
+            return 405, {'error': 'use POST'}, ()
+
+        # Refuse early instead of letting the queue and the latency grow
+        if self.service.overloaded():
+            self.service.rejected += 1
+            return 503, {'error': 'overloaded'}, ('Retry-After: 1',)
+
+        content_type = headers.get('content-type', 'image/jpeg').split(';')[0].strip()
+        try:
+            return 200, await self.service.detect(body, content_type, parse_qs(url.query)), ()
+        except RequestError as e:
+            self.service.errors += 1
+            return e.status, {'error': str(e)}, ()
+        except Exception as e:
+            self.service.errors += 1
+            print(f"Detection failed: {e}")
+            return 503, {'error': 'detection failed'}, ()
+
+    async def serve(self):
+        await self.service.start()
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        port = server.sockets[0].getsockname()[1]
+        print(f"Detection service on http://{self.host}:{port}/detect")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.service.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve emotion detection to other local processes over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--prep-workers', type=int, default=4,
+                        help='threads decoding frames and finding faces')
+    parser.add_argument('--inference-workers', type=int, default=1,
+                        help='threads running batches through the shared model')
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=5,
+                        help='how long a batch waits for more requests before it runs')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='requests in progress before new ones get 503')
+    parser.add_argument('--max-body-mb', type=float, default=16)
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="find faces on a copy downscaled by this factor")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    model = EmotionModel(backend=args.emotion_backend)
+    print(model.summary())
+
+    service = DetectionService(model, prep_workers=args.prep_workers,
+                               inference_workers=args.inference_workers, max_batch=args.max_batch,
+                               max_wait_ms=args.max_wait_ms, max_pending=args.max_pending,
+                               inference_scale=args.inference_scale)
+    server = DetectionServer(service, args.host, args.port, args.max_body_mb)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    print(service.summary())
+    print(model.summary())
+
+
+if __name__ == '__main__':
+    main()
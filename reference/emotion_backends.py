@@ -0,0 +1,208 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+BACKENDS = ['keras', 'onnx', 'tflite']
+DEFAULT_MODEL_DIR = Path('models')
+IMAGE_SUFFIXES = ['.png', '.jpg', '.jpeg']
+
+
+def quantized_model_path(backend, model_dir=DEFAULT_MODEL_DIR):
+    suffix = {'onnx': 'onnx', 'tflite': 'tflite'}[backend]
+    return Path(model_dir) / f'emotion_int8.{suffix}'
+
+
+class OnnxEmotionNetwork:
+    def __init__(self, path, threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch, training=False):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def load_tflite_interpreter():
+    # Prefer the standalone runtimes, full TensorFlow is the heaviest way to run a .tflite file
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteEmotionNetwork:
+    def __init__(self, path, threads=None):
+        Interpreter = load_tflite_interpreter()
+        self.interpreter = Interpreter(model_path=str(path), num_threads=threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def __call__(self, batch, training=False):
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(batch)
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def require_quantized_model(backend, model_dir=DEFAULT_MODEL_DIR):
+    # int8 ranges need real faces to calibrate on, so there is no automatic export
+    path = quantized_model_path(backend, model_dir)
+    if not path.exists():
+        raise FileNotFoundError(f"No quantized {backend} emotion model at {path}. Export one calibrated on "
+                                f"face photos first: python emotion_backends.py export --backend {backend} "
+                                f"--images <face photos>")
+    return path
+
+
+def load_quantized_network(backend, model_dir=DEFAULT_MODEL_DIR, threads=None):
+    path = require_quantized_model(backend, model_dir)
+    if backend == 'onnx':
+        return OnnxEmotionNetwork(path, threads)
+    return TFLiteEmotionNetwork(path, threads)
+
+
+def load_face_batches(image_dir, batch_size=16, limit=200):
+    # Face crops from a directory of photos
+    from emotion_model import preprocess_faces
+    from face_tracker import FaceTracker
+
+    tracker = FaceTracker()
+    faces = []
+    for path in sorted(Path(image_dir).iterdir())[:limit]:
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        box = tracker.locate(image)
+        faces.append(tracker.crop(image, box) if box is not None else image)
+    if not faces:
+        raise ValueError(f"No images found in {image_dir}")
+    return [preprocess_faces(faces[i:i + batch_size]) for i in range(0, len(faces), batch_size)]
+
+
+def export_quantized(backend, calibration_dir, model_dir=DEFAULT_MODEL_DIR):
+    import tensorflow as tf
+    from emotion_model import INPUT_SIZE, build_emotion_network
+
+    calibration = load_face_batches(calibration_dir)
+    network = build_emotion_network('keras')
+    path = quantized_model_path(backend, model_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written under a temporary name and renamed, so a running matcher never loads half a file
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+    if backend == 'onnx':
+        try:
+            import tf2onnx
+            from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                                  quantize_static)
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+        except ImportError:
+            raise ImportError("Exporting the onnx backend needs tf2onnx and onnxruntime: "
+                              "pip install tf2onnx onnxruntime")
+
+        float_path = path.with_name('emotion_fp32.onnx')
+        tmp_float_path = float_path.with_name(f'.{float_path.name}.{os.getpid()}.tmp')
+        spec = [tf.TensorSpec((None, INPUT_SIZE, INPUT_SIZE, 1), tf.float32, name='input')]
+
+        # from_keras can't find the output tensors of Keras 3 models, a traced function works
+        @tf.function(input_signature=spec)
+        def forward(batch):
+            return network(batch, training=False)
+
+        model_proto, _ = tf2onnx.convert.from_function(forward, input_signature=spec)
+        input_name = model_proto.graph.input[0].name
+        tmp_float_path.write_bytes(model_proto.SerializeToString())
+        quant_pre_process(str(tmp_float_path), str(tmp_float_path), skip_symbolic_shape=True)
+
+        class Calibration(CalibrationDataReader):
+            def __init__(self):
+                self.batches = iter(calibration)
+
+            def get_next(self):
+                batch = next(self.batches, None)
+                return None if batch is None else {input_name: batch}
+
+        quantize_static(str(tmp_float_path), str(tmp_path), Calibration(), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        os.replace(tmp_float_path, float_path)
+    else:
+        def representative_dataset():
+            for batch in calibration:
+                for sample in batch:
+                    yield [sample[None]]
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(network)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Float in and out keeps the preprocessing identical to the Keras path
+        tmp_path.write_bytes(converter.convert())
+
+    os.replace(tmp_path, path)
+    print(f"Wrote {path} ({path.stat().st_size / 1024:.0f} KiB)")
+    return path
+
+
+def parity_check(backend, image_dir, model_dir=DEFAULT_MODEL_DIR, min_agreement=0.9):
+    from emotion_model import build_emotion_network
+
+    reference = build_emotion_network('keras')
+    candidate = load_quantized_network(backend, model_dir)
+    batches = load_face_batches(image_dir)
+
+    expected = np.concatenate([np.asarray(reference(b, training=False)) for b in batches])
+    actual = np.concatenate([np.asarray(candidate(b)) for b in batches])
+    agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    mean_error = float(np.abs(expected - actual).mean())
+    max_error = float(np.abs(expected - actual).max())
+
+    print(f"{backend} vs keras on {len(expected)} faces: top-1 agreement {agreement:.1%}, "
+          f"mean |dp| {mean_error:.4f}, max |dp| {max_error:.4f}")
+    return agreement >= min_agreement
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and check quantized emotion model backends")
+    parser.add_argument('command', choices=['export', 'parity'])
+    parser.add_argument('--backend', choices=['onnx', 'tflite'], default='onnx')
+    parser.add_argument('--model-dir', default=str(DEFAULT_MODEL_DIR))
+    parser.add_argument('--images', help="directory of face photos for calibration or the parity check")
+    parser.add_argument('--min-agreement', type=float, default=0.9,
+                        help="fail the parity check below this top-1 agreement with keras")
+    args = parser.parse_args(argv)
+
+    if not args.images:
+        parser.error(f"{args.command} needs --images, int8 ranges are calibrated on real faces")
+    if args.command == 'export':
+        export_quantized(args.backend, args.images, args.model_dir)
+        return 0
+
+    return 0 if parity_check(args.backend, args.images, args.model_dir, args.min_agreement) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
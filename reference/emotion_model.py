@@ -0,0 +1,118 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from startup_profile import startup
+
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+INPUT_SIZE = 48
+
+
+def build_emotion_network(backend='keras'):
+    if backend != 'keras':
+        from emotion_backends import load_quantized_network
+        with startup.stage(f'load {backend} emotion model'):
+            return load_quantized_network(backend)
+
+    # DeepFace pulls in TensorFlow, so it is only imported once a model is needed
+    with startup.stage('import deepface and tensorflow'):
+        from deepface import DeepFace
+
+    # build_model grew a task argument in newer DeepFace releases, and wraps
+    # the Keras network in a client object instead of returning it directly
+    with startup.stage('build emotion model'):
+        try:
+            model = DeepFace.build_model(model_name='Emotion', task='facial_attribute')
+        except TypeError:
+            model = DeepFace.build_model('Emotion')
+    return getattr(model, 'model', model)
+
+
+def preprocess_faces(faces):
+    # BGR or grayscale crops -> (N, 48, 48, 1) float32 in 0-1, as DeepFace feeds the model
+    batch = np.empty((len(faces), INPUT_SIZE, INPUT_SIZE, 1), dtype=np.float32)
+    for i, face in enumerate(faces):
+        gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+        batch[i, :, :, 0] = cv2.resize(gray, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+    batch /= 255.0
+    return batch
+
+
+def to_scores(probabilities):
+    # Same shape as DeepFace.analyze's 'emotion' field: label -> percentage
+    return {label: float(p) * 100 for label, p in zip(EMOTION_LABELS, probabilities)}
+
+
+def dominant_emotion(scores):
+    return max(scores, key=scores.get)
+
+
+class EmotionModel:
+    def __init__(self, network=None, warm_up=True, backend='keras'):
+        start = time.perf_counter()
+        self.backend = backend
+        self.network = network if network is not None else build_emotion_network(backend)
+        self.load_seconds = time.perf_counter() - start
+        self.warmup_seconds = 0.0
+        self.calls = 0
+        self.faces = 0
+        self.preprocess_seconds = 0.0
+        self.predict_seconds = 0.0
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self):
+        # The first call builds the TensorFlow graph, pay for it before any real frame
+        start = time.perf_counter()
+        with startup.stage('warm up emotion model'):
+            self.predict(np.zeros((1, INPUT_SIZE, INPUT_SIZE, 1), dtype=np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+
+    def predict(self, batch):
+        return np.asarray(self.network(batch, training=False))
+
+    def scores(self, faces):
+        if not faces:
+            return []
+        start = time.perf_counter()
+        batch = preprocess_faces(faces)
+        preprocessed = time.perf_counter()
+        probabilities = self.predict(batch)
+        self.preprocess_seconds += preprocessed - start
+        self.predict_seconds += time.perf_counter() - preprocessed
+        self.calls += 1
+        self.faces += len(faces)
+        return [to_scores(p) for p in probabilities]
+
+    def summary(self):
+        text = f"Emotion model ({self.backend}): loaded in {self.load_seconds:.2f} s, warm-up {self.warmup_seconds:.2f} s"
+        if self.calls:
+            text += (f", {self.calls} calls, {1000 * self.preprocess_seconds / self.calls:.2f} ms preprocess "
+                     f"+ {1000 * self.predict_seconds / self.calls:.2f} ms predict per call")
+        return text
+
+
+class BackgroundModelLoader:
+    # Builds a model on its own thread so the camera and window can start meanwhile
+    def __init__(self, factory=EmotionModel):
+        self.factory = factory
+        self.model = None
+        self.error = None
+        self.done = threading.Event()
+        self._thread = threading.Thread(target=self._load, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            self.model = self.factory()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def result(self, timeout=0):
+        # The model once loaded, None while still loading or if loading failed
+        self.done.wait(timeout)
+        return self.model
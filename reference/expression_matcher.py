@@ -1,18 +1,85 @@
+from startup_profile import startup
 import cv2
-import numpy as np
 from pathlib import Path
-from deepface import DeepFace
+import argparse
+import functools
 import json
+import time
+
+from analysis_scheduler import AnalysisScheduler
+from async_inference import AsyncExpressionWorker, LatencyTracker
+from compositor import Compositor
+from emotion_model import BackgroundModelLoader, EmotionModel, dominant_emotion
+from expression_smoother import ExpressionSmoother
+from face_detectors import detector_names, pick_detector
+from face_tracker import FaceTracker
+from frame_profiler import FrameProfiler
+from frame_sinks import HeadlessSink, MjpegSink, WindowSink
+from frame_sources import CameraSource, ThreadedGrabber, open_source
+from frame_writer import DROP_POLICIES, FrameWriter
+from image_atlas import ByteBudgetLRU, ImageAtlas
+from perf_stats import ConsoleExporter, JsonLinesExporter, MetricsServer, StageStats, draw_hud
+from quality_controller import QualityController
+from result_cache import EmotionResultCache, perceptual_hash
+
+startup.mark('import cv2, numpy and app modules')
 
 class ExpressionMatcher:
-    def __init__(self, expression_mapping_file='expressions.json', image_directory='images'):
+    def __init__(self, expression_mapping_file='expressions.json', image_directory='images',
+                 async_inference=False, source=None, sink=None, max_frames=None, scheduler=None,
+                 tracker=None, model=None, model_loader=None, smoother=None, result_cache=None,
+                 use_atlas=True, image_cache_bytes=256 * 2 ** 20, load_model=True, writer=None,
+                 record_path=None, record_fps=30.0, stats=None, hud=False, quality=None, profiler=None,
+                 profile_start=None):
+        self.start_time = time.perf_counter()
         self.mapping_file = Path(expression_mapping_file)
         self.image_directory = Path(image_directory)
         self.expression_images = self.load_expression_mapping()
-        self.cap = cv2.VideoCapture(0)
-        self.image_cache = {}
+        self.source = source if source is not None else ThreadedGrabber(CameraSource(0))
+        self.sink = sink if sink is not None else WindowSink()
+        self.max_frames = max_frames
+        self.scheduler = scheduler if scheduler is not None else AnalysisScheduler()
+        self.tracker = tracker if tracker is not None else FaceTracker()
+        self.smoother = smoother if smoother is not None else ExpressionSmoother()
+        self.result_cache = result_cache
+        self.image_cache = ByteBudgetLRU(image_cache_bytes)
+        self.compositor = Compositor()
         self.current_expression = "neutral"
+        self.image_variants = {self.current_expression: 0}
         self.frame_count = 0
+        self.async_inference = async_inference
+        self.worker = None
+        self.latency = LatencyTracker()
+        self.first_detection = None
+        self.writer = writer
+        # Per-stage timings are only collected when something consumes them
+        self.stats = stats if stats is not None or not hud else StageStats()
+        self.hud = hud
+        self.record_path = record_path
+        self.record_fps = record_fps
+        self.record_size = None
+        self.last_inference_seconds = None
+        self.display_scale = 1.0
+        self.quality = quality
+        if quality is not None:
+            self.apply_quality(quality.settings)
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+        self.profile_start = profile_start
+
+        # Pre-decoded character images, rebuilt when any of them changes on disk
+        self.atlas = None
+        if use_atlas and self.image_directory.exists():
+            try:
+                self.atlas = ImageAtlas.open(self.expression_images, self.image_directory)
+            except OSError as e:
+                # e.g. a read-only image directory, images are then decoded on first use
+                print(f"Image atlas unavailable ({e}), decoding images on first use")
+
+        # The emotion model is built and warmed up in the background unless one is given
+        self.model = model
+        self.model_loader = None
+        if model is None and load_model:
+            self.model_loader = model_loader if model_loader is not None else BackgroundModelLoader()
 
     def load_expression_mapping(self):
         if not self.mapping_file.exists():
@@ -32,24 +99,37 @@ class ExpressionMatcher:
         with open(self.mapping_file, 'r') as f:
             return json.load(f)
 
-    def get_image_for_expression(self, expression):
+    def get_image_name_for_expression(self, expression):
         expression = expression.lower()
 
-        # Find image name for expression
-        image_name = None
+        # Find images for expression
+        images = None
         if expression in self.expression_images and self.expression_images[expression]:
-            image_name = self.expression_images[expression][0]
+            images = self.expression_images[expression]
         elif self.expression_images.get("neutral"):
-            image_name = self.expression_images["neutral"][0]
+            images = self.expression_images["neutral"]
         else:
-            for images in self.expression_images.values():
-                if images:
-                    image_name = images[0]
+            for candidates in self.expression_images.values():
+                if candidates:
+                    images = candidates
                     break
 
+        if not images:
+            return None
+
+        # Each time an expression comes back, the next image in its list is shown
+        return images[self.image_variants.get(expression, 0) % len(images)]
+
+    def get_image_for_expression(self, expression):
+        return self.load_image(self.get_image_name_for_expression(expression))
+
+    def load_image(self, image_name):
         if not image_name:
             return None
 
+        if self.atlas is not None and image_name in self.atlas:
+            return self.atlas.get(image_name)
+
         # Load from cache or disk
         if image_name not in self.image_cache:
             img = cv2.imread(str(self.image_directory / image_name))
@@ -58,70 +138,364 @@ class ExpressionMatcher:
 
         return self.image_cache.get(image_name)
 
-    def detect_expression(self, frame):
+    def model_ready(self):
+        if self.model is None and self.model_loader is not None:
+            self.model = self.model_loader.result()
+            if self.model is not None:
+                print(self.model.summary())
+            elif self.model_loader.error is not None:
+                print(f"Error: Could not load the emotion model: {self.model_loader.error}")
+                self.model_loader = None
+        return self.model is not None
+
+    def model_settled(self):
+        # Loaded, failed or never requested, either way nothing loads in the background
+        return self.model_ready() or self.model_loader is None
+
+    def status_text(self):
+        if self.first_detection is not None:
+            return None
+        if self.model is None and self.model_loader is None:
+            return "Emotion model unavailable"
+        return "Warming up..."
+
+    def detect_scores(self, face):
+        # Near-identical faces reuse a recent result instead of running the model,
+        # last_inference_seconds stays None unless the model actually ran
+        self.last_inference_seconds = None
+        face_hash = None
+        if self.result_cache is not None:
+            face_hash = perceptual_hash(face)
+            scores = self.result_cache.lookup(face_hash)
+            if scores is not None:
+                return scores
+
+        # The face is already located and cropped, so it goes straight to the model
         try:
-            result = DeepFace.analyze(frame, actions=['emotion'],
-                                     enforce_detection=False, detector_backend='opencv')
-            if isinstance(result, list):
-                result = result[0]
-            return result['dominant_emotion']
+            start = time.perf_counter()
+            scores = self.model.scores([face])[0]
+            self.last_inference_seconds = time.perf_counter() - start
         except:
+            return None
+        if face_hash is not None:
+            self.result_cache.store(face_hash, scores)
+
+        if self.first_detection is None:
+            self.first_detection = time.perf_counter() - self.start_time
+            startup.mark('first detection')
+            print(f"First detection {self.first_detection:.2f} s after start")
+        return scores
+
+    def detect_expression(self, face):
+        scores = self.detect_scores(face)
+        if scores is None:
             return self.current_expression
+        return dominant_emotion(scores)
+
+    def apply_scores(self, scores, now=None):
+        if scores is not None:
+            self.set_expression(self.smoother.update(scores, now))
+
+    def set_expression(self, expression):
+        if expression != self.current_expression:
+            self.image_variants[expression] = self.image_variants.get(expression, -1) + 1
+        self.current_expression = expression
 
     def run(self):
-        print("Expression Matcher started! Press 's' to save, 'q' to quit\n")
+        print("Expression Matcher started! Press 's' to save, 'r' to record, 'p' to profile, 'q' to quit\n")
         saved_count = 0
+        last_result = None
+        if self.writer is None:
+            self.writer = FrameWriter()
 
-        while True:
-            ret, frame = self.cap.read()
-            if not ret:
-                break
-
-            # Detect expression every 10 frames
-            if self.frame_count % 10 == 0:
-                self.current_expression = self.detect_expression(frame)
-            self.frame_count += 1
-
-            # Get character image
-            char_img = self.get_image_for_expression(self.current_expression)
-            h, w = frame.shape[:2]
-
-            # Prepare character image or placeholder
-            if char_img is not None:
-                char_h, char_w = h, int(h * char_img.shape[1] / char_img.shape[0])
-                char_resized = cv2.resize(char_img, (char_w, char_h))
-            else:
-                char_h, char_w = h, int(h * 0.75)
-                char_resized = np.full((char_h, char_w, 3), (220, 220, 220), dtype=np.uint8)
-                cv2.putText(char_resized, f"No image", (char_w//4, char_h//2),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 100, 100), 2)
-
-            # Create display with bottom bar
-            bar_height = 50
-            display_frame = np.zeros((h + bar_height, w + char_w, 3), dtype=np.uint8)
-            display_frame[0:h, 0:w] = frame
-            display_frame[0:h, w:w + char_w] = char_resized
-            cv2.putText(display_frame, f"Expression: {self.current_expression.capitalize()}",
-                       (20, h + 35), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-
-            cv2.imshow('Expression Matcher', display_frame)
-
-            # Handle key presses
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('s'):
-                Path('output').mkdir(exist_ok=True)
-                filename = f'output/expression_{saved_count:03d}.png'
-                cv2.imwrite(filename, display_frame)
-                print(f"Saved: {filename}")
-                saved_count += 1
-
-        self.cap.release()
-        cv2.destroyAllWindows()
-
-
-def main():
+        if self.async_inference:
+            self.worker = AsyncExpressionWorker(self.detect_scores).start()
+
+        # Ctrl-C is the only way to stop a streamed or headless session, and
+        # the recording, profile and sinks below still need closing
+        try:
+            while self.max_frames is None or self.frame_count < self.max_frames:
+                # tracemalloc would also trace the background TensorFlow import, so
+                # a capture waits until the model has loaded (or failed to)
+                if (self.profile_start is not None and self.frame_count >= self.profile_start
+                        and self.model_settled()):
+                    self.profile_start = None
+                    self.profiler.start()
+                profiling = self.profiler.active
+                if profiling:
+                    self.profiler.enter('capture')
+                start = time.perf_counter()
+                ret, frame = self.source.read()
+                frame_time = time.perf_counter()
+                if not ret:
+                    break
+                if profiling:
+                    self.profiler.enter('detection')
+
+                # Follow the primary face, then classify its crop when the scene
+                # changed or the max interval passed
+                face_box = self.tracker.update(frame)
+                track_done = time.perf_counter()
+                inferred = False
+                if (face_box is not None and self.model_ready()
+                        and self.scheduler.should_analyze(frame, frame_time)):
+                    face = self.tracker.crop(frame, face_box)
+                    if self.worker is not None:
+                        self.worker.submit(face, frame_time)
+                    else:
+                        self.apply_scores(self.detect_scores(face), frame_time)
+                        inferred = self.last_inference_seconds is not None
+                self.frame_count += 1
+
+                # Pick up the newest result from the background worker, if any
+                new_result = None
+                if self.worker is not None:
+                    result = self.worker.latest()
+                    if result is not None and result[2] != last_result:
+                        new_result = result
+                        last_result = result[2]
+                        self.apply_scores(result[0], result[1])
+                        inferred = True
+                detect_done = time.perf_counter()
+                if profiling:
+                    self.profiler.enter('compose')
+
+                # Compose camera, character image and bottom bar
+                char_name = self.get_image_name_for_expression(self.current_expression)
+                char_img = self.load_image(char_name)
+                shown_frame = frame
+                if self.display_scale < 1:
+                    shown_frame = cv2.resize(frame, (round(frame.shape[1] * self.display_scale),
+                                                     round(frame.shape[0] * self.display_scale)),
+                                             interpolation=cv2.INTER_LINEAR)
+                display_frame = self.compositor.compose(shown_frame, self.current_expression, char_name, char_img,
+                                                        status=self.status_text())
+                if self.hud:
+                    draw_hud(display_frame, self.stats.cached_snapshot(), shown_frame.shape[1])
+                compose_done = time.perf_counter()
+                if profiling:
+                    self.profiler.end_frame()
+
+                self.sink.show(display_frame)
+                show_done = time.perf_counter()
+                key = self.sink.poll_key()
+                key_done = time.perf_counter()
+                if self.frame_count == 1:
+                    startup.mark('first frame displayed')
+                    if self.record_path:
+                        self.start_recording(self.record_path, display_frame)
+                if self.writer.recording:
+                    # The video keeps the size it started with when the display scale changes
+                    if (display_frame.shape[1], display_frame.shape[0]) != self.record_size:
+                        self.writer.record(cv2.resize(display_frame, self.record_size))
+                    else:
+                        self.writer.record(display_frame)
+                if new_result is not None:
+                    self.latency.record(new_result[1])
+                if self.stats is not None:
+                    self.stats.record({
+                        'capture': frame_time - start,
+                        'track': track_done - frame_time,
+                        'inference': detect_done - track_done,
+                        'compose': compose_done - detect_done,
+                        'imshow': show_done - compose_done,
+                        'waitkey': key_done - show_done,
+                    }, key_done, inferred)
+                if self.quality is not None:
+                    changes = self.quality.update(key_done, key_done - frame_time,
+                                                  self.last_inference_seconds if inferred else None)
+                    if changes:
+                        self.apply_quality(changes)
+
+                # Handle key presses
+                if key == ord('q'):
+                    break
+                elif key == ord('s'):
+                    self.writer.snapshot(display_frame, f'output/expression_{saved_count:03d}.png')
+                    saved_count += 1
+                elif key == ord('r'):
+                    if self.writer.recording:
+                        self.writer.stop_recording()
+                    else:
+                        self.start_recording(time.strftime('output/session_%Y%m%d_%H%M%S.mp4'), display_frame)
+                elif key == ord('p'):
+                    if not self.model_settled():
+                        print("Profiling starts once the emotion model has loaded")
+                    self.profile_start = self.frame_count
+        except KeyboardInterrupt:
+            print("Interrupted")
+        finally:
+            # A capture cut short by the end of the source is still saved, and
+            # the recording, source and sink are closed even if that fails
+            try:
+                self.profiler.finish()
+            finally:
+                self.shutdown()
+
+    def shutdown(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.report_latency()
+            self.worker = None
+
+        self.writer.close()
+        if self.writer.queued or self.writer.snapshots:
+            print(self.writer.summary())
+        print(self.scheduler.summary())
+        print(self.tracker.summary())
+        print(self.smoother.summary())
+        if self.result_cache is not None:
+            print(self.result_cache.summary())
+        if self.model is not None:
+            print(self.model.summary())
+        if self.stats is not None:
+            self.stats.close()
+        if self.quality is not None:
+            print(self.quality.summary())
+            self.quality.close()
+        if isinstance(self.source, ThreadedGrabber):
+            print(self.source.summary())
+        if self.profiler.captures:
+            print(self.profiler.summary())
+        if self.profile_start is not None:
+            print("No profile captured, the emotion model was still loading")
+        self.source.release()
+        self.sink.close()
+
+    def start_recording(self, path, display_frame):
+        height, width = display_frame.shape[:2]
+        self.record_size = (width, height)
+        self.writer.start_recording(path, self.record_fps, self.record_size)
+
+    def apply_quality(self, settings):
+        if 'analysis_interval_ms' in settings:
+            self.scheduler.min_interval = settings['analysis_interval_ms'] / 1000.0
+            self.scheduler.max_interval = max(self.scheduler.max_interval, self.scheduler.min_interval)
+        if 'inference_scale' in settings:
+            self.tracker.set_detect_scale(settings['inference_scale'])
+        if 'display_scale' in settings:
+            self.display_scale = settings['display_scale']
+
+    def report_latency(self):
+        stats = self.latency.summary()
+        if stats is None:
+            return
+        print(f"Inference-to-display latency over {stats['count']} results: "
+              f"mean {stats['mean_ms']:.1f} ms, p50 {stats['p50_ms']:.1f} ms, "
+              f"p95 {stats['p95_ms']:.1f} ms, max {stats['max_ms']:.1f} ms")
+        print(f"Frames submitted: {self.worker.submitted}, dropped as stale: {self.worker.dropped}")
+
+
+def parse_size(text):
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WxH, got {text!r}")
+    return width, height
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Match your facial expression to character images")
+    parser.add_argument('--async-inference', action='store_true',
+                        help="run expression detection on a background thread")
+    parser.add_argument('--source', default='camera:0',
+                        help="camera[:index], synthetic[:WxH[:count]], a video file or an image directory")
+    parser.add_argument('--loop', action='store_true',
+                        help="restart video file and image directory sources when they run out")
+    parser.add_argument('--capture-size', type=parse_size, metavar='WxH',
+                        help="ask the camera for this resolution")
+    parser.add_argument('--capture-fps', type=float,
+                        help="ask the camera for this frame rate")
+    parser.add_argument('--capture-buffer-size', type=int,
+                        help="frames the camera driver may queue, 1 keeps frames fresh")
+    parser.add_argument('--grab-buffers', type=int, default=3,
+                        help="frame buffers of the camera capture thread, 0 reads the camera on the main loop")
+    parser.add_argument('--headless', action='store_true',
+                        help="don't open a window, print per-stage frame rates instead")
+    parser.add_argument('--max-frames', type=int, default=None,
+                        help="stop after this many frames")
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="find and track faces on a copy downscaled by this factor, "
+                             "the emotion crop still comes from the full-resolution frame")
+    parser.add_argument('--detector', choices=['auto'] + detector_names(), default='auto',
+                        help="face detector, auto picks the fastest one that passed calibration on this machine")
+    parser.add_argument('--detector-profile', metavar='PATH',
+                        help="calibration profile written by face_detectors.py, default profiles/detectors_<host>.json")
+    parser.add_argument('--min-detection-rate', type=float, default=0.9,
+                        help="share of calibration frames an auto-picked detector must find a face in")
+    parser.add_argument('--change-threshold', type=float, default=6.0,
+                        help="mean gray-level change (0-255) that triggers a new analysis")
+    parser.add_argument('--min-interval-ms', type=float, default=100,
+                        help="never analyze more often than this")
+    parser.add_argument('--max-interval-ms', type=float, default=1000,
+                        help="always analyze at least this often")
+    parser.add_argument('--smoothing-window', type=int, default=5,
+                        help="number of recent score vectors averaged, 1 disables smoothing")
+    parser.add_argument('--smoothing-alpha', type=float, default=0.5,
+                        help="weight of the newest scores in the exponential average")
+    parser.add_argument('--hysteresis', type=float, default=10.0,
+                        help="percentage points a new expression must lead by before it is shown")
+    parser.add_argument('--min-dwell-ms', type=float, default=400,
+                        help="minimum time an expression stays on screen")
+    parser.add_argument('--cache-distance', type=int, default=4,
+                        help="reuse a cached result for faces within this many hash bits, -1 disables the cache")
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help="maximum number of cached results")
+    parser.add_argument('--cache-ttl-ms', type=float, default=3000,
+                        help="cached results older than this are not reused")
+    parser.add_argument('--no-atlas', action='store_true',
+                        help="decode character images on first use instead of from the pre-decoded atlas")
+    parser.add_argument('--image-cache-mb', type=float, default=256,
+                        help="memory budget for decoded character images outside the atlas")
+    parser.add_argument('--record', metavar='PATH',
+                        help="record the composited view to this video file from the start")
+    parser.add_argument('--record-fps', type=float, default=30.0)
+    parser.add_argument('--writer-queue', type=int, default=64,
+                        help="frames that may wait for the disk before the drop policy applies")
+    parser.add_argument('--drop-policy', choices=DROP_POLICIES, default='drop-newest',
+                        help="what to do with recorded frames when the disk falls behind")
+    parser.add_argument('--stream-port', type=int,
+                        help="serve the composited view as an MJPEG stream on localhost instead of a window")
+    parser.add_argument('--stream-quality', type=int, default=80,
+                        help="JPEG quality of the stream")
+    parser.add_argument('--stream-encoders', type=int, default=2,
+                        help="threads encoding stream frames")
+    parser.add_argument('--hud', action='store_true',
+                        help="overlay FPS, inference rate and per-stage p50/p99 timings")
+    parser.add_argument('--metrics-jsonl', metavar='PATH',
+                        help="append per-stage timing snapshots to this file as JSON lines")
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve per-stage timings in Prometheus text format on localhost")
+    parser.add_argument('--metrics-interval', type=float, default=2.0,
+                        help="seconds between console and JSON lines reports")
+    parser.add_argument('--target-fps', type=float,
+                        help="adapt the analysis interval, inference scale and display scale to hold this frame rate")
+    parser.add_argument('--quality-max-interval-ms', type=float, default=1000,
+                        help="longest analysis interval the quality controller may use")
+    parser.add_argument('--quality-min-inference-scale', type=float, default=0.25,
+                        help="smallest inference scale the quality controller may use")
+    parser.add_argument('--quality-min-display-scale', type=float, default=0.5,
+                        help="smallest display scale the quality controller may use")
+    parser.add_argument('--quality-log', metavar='PATH',
+                        help="append every quality adjustment to this file as JSON lines")
+    parser.add_argument('--profile-start', type=int, metavar='FRAME',
+                        help="capture a cProfile and tracemalloc profile starting at this frame, 0 for the first")
+    parser.add_argument('--profile-frames', type=int, default=300,
+                        help="frames covered by each profile capture, also for captures started with 'p'")
+    parser.add_argument('--profile-dir', default='output',
+                        help="directory for profile reports and .prof files")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras',
+                        help="run the emotion model with Keras or an int8-quantized ONNX/TFLite export")
+    parser.add_argument('--import-profile', action='store_true',
+                        help="print where startup time went on exit")
+    args = parser.parse_args(argv)
+    if args.grab_buffers == 1 or args.grab_buffers < 0:
+        parser.error("--grab-buffers must be 0 (no capture thread) or at least 2")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
     image_dir = Path('images')
 
     if not image_dir.exists():
@@ -137,10 +511,77 @@ def main():
         return
 
     print(f"Found {len(images)} image(s) in 'images' directory\n")
+    startup.mark('arguments and images checked')
+
+    try:
+        detector, detector_note = pick_detector(args.detector, args.detector_profile, args.min_detection_rate)
+    except Exception as e:
+        print(f"Error: Could not load the {args.detector} face detector: {e}")
+        return
+    print(detector_note)
+    startup.mark('face detector loaded')
+
+    # Start loading the model now, the camera and window come up meanwhile
+    model_loader = BackgroundModelLoader(functools.partial(EmotionModel, backend=args.emotion_backend))
+
+    try:
+        source = open_source(args.source, loop=args.loop, capture_size=args.capture_size,
+                             capture_fps=args.capture_fps, capture_buffer_size=args.capture_buffer_size,
+                             grab_buffers=args.grab_buffers)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    startup.mark('frame source opened')
+
+    if args.stream_port is not None:
+        sink = MjpegSink(args.stream_port, quality=args.stream_quality, encode_workers=args.stream_encoders)
+    else:
+        sink = HeadlessSink() if args.headless else WindowSink()
 
-    matcher = ExpressionMatcher()
+    exporters = []
+    if args.headless:
+        exporters.append(ConsoleExporter())
+    if args.metrics_jsonl:
+        exporters.append(JsonLinesExporter(args.metrics_jsonl))
+    stats = None
+    if exporters or args.hud or args.metrics_port:
+        stats = StageStats(exporters=exporters, export_interval=args.metrics_interval)
+    metrics_server = MetricsServer(stats, args.metrics_port) if args.metrics_port else None
+    scheduler = AnalysisScheduler(args.change_threshold, args.min_interval_ms, args.max_interval_ms)
+    smoother = ExpressionSmoother(args.smoothing_window, args.smoothing_alpha, args.hysteresis,
+                                  args.min_dwell_ms)
+    result_cache = None
+    if args.cache_distance >= 0:
+        result_cache = EmotionResultCache(args.cache_size, args.cache_distance, args.cache_ttl_ms / 1000)
+    quality = None
+    if args.target_fps:
+        # The configured settings are the best quality the controller returns to
+        quality = QualityController(args.target_fps,
+                                    interval_ms=(args.min_interval_ms,
+                                                 max(args.min_interval_ms, args.quality_max_interval_ms)),
+                                    inference_scale=(min(args.inference_scale, args.quality_min_inference_scale),
+                                                     args.inference_scale),
+                                    display_scale=(min(1.0, args.quality_min_display_scale), 1.0),
+                                    log_path=args.quality_log)
+    matcher = ExpressionMatcher(async_inference=args.async_inference, source=source, sink=sink,
+                                max_frames=args.max_frames, scheduler=scheduler,
+                                tracker=FaceTracker(detect_scale=args.inference_scale, detector=detector),
+                                model_loader=model_loader, smoother=smoother,
+                                result_cache=result_cache, use_atlas=not args.no_atlas,
+                                image_cache_bytes=int(args.image_cache_mb * 2 ** 20),
+                                writer=FrameWriter(args.writer_queue, args.drop_policy),
+                                record_path=args.record, record_fps=args.record_fps,
+                                stats=stats, hud=args.hud, quality=quality,
+                                profiler=FrameProfiler(args.profile_frames, args.profile_dir),
+                                profile_start=args.profile_start)
+    startup.mark('matcher constructed')
     matcher.run()
 
+    if metrics_server is not None:
+        metrics_server.close()
+    if args.import_profile:
+        startup.report()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,62 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from emotion_model import EMOTION_LABELS
+
+
+class ExpressionSmoother:
+    # Keeps the last `window` score vectors and switches the displayed
+    # expression only when the smoothed winner leads the current one by
+    # `hysteresis` percentage points and the current one has been shown for
+    # at least min_dwell_ms
+    def __init__(self, window=5, alpha=0.5, hysteresis=10.0, min_dwell_ms=400, initial='neutral'):
+        self.history = deque(maxlen=max(1, window))
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell_ms / 1000.0
+        self.current = initial
+        self.changed_at = None
+        self.smoothed = None
+        self.switches = 0
+        self.suppressed = 0
+
+    def update(self, scores, now=None):
+        now = time.perf_counter() if now is None else now
+        self.history.appendleft(np.array([scores.get(label, 0.0) for label in EMOTION_LABELS]))
+
+        # Exponential weights over the ring buffer, newest first
+        weights = (1 - self.alpha) ** np.arange(len(self.history))
+        self.smoothed = np.average(np.array(self.history), axis=0, weights=weights)
+
+        candidate = EMOTION_LABELS[int(self.smoothed.argmax())]
+        if candidate == self.current:
+            return self.current
+
+        if self.changed_at is None:
+            return self._switch(candidate, now)
+
+        if self.current in EMOTION_LABELS:
+            lead = self.smoothed.max() - self.smoothed[EMOTION_LABELS.index(self.current)]
+        else:
+            lead = self.hysteresis
+        if lead >= self.hysteresis and now - self.changed_at >= self.min_dwell:
+            return self._switch(candidate, now)
+
+        self.suppressed += 1
+        return self.current
+
+    def _switch(self, expression, now):
+        self.current = expression
+        self.changed_at = now
+        self.switches += 1
+        return expression
+
+    def smoothed_scores(self):
+        if self.smoothed is None:
+            return None
+        return dict(zip(EMOTION_LABELS, self.smoothed.tolist()))
+
+    def summary(self):
+        return f"Smoothing: {self.switches} expression switches, {self.suppressed} flickers suppressed"
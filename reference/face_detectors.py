@@ -0,0 +1,272 @@
+import argparse
+import json
+import socket
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+DEFAULT_MODEL_DIR = Path('models')
+DEEPFACE_WEIGHTS = Path.home() / '.deepface' / 'weights'
+DEFAULT_PROFILE_DIR = Path('profiles')
+DEEPFACE_BACKENDS = ['opencv', 'ssd', 'mtcnn', 'fastmtcnn', 'retinaface', 'mediapipe', 'yolov8n', 'yolov11n',
+                     'yunet', 'centerface', 'dlib']
+
+# Detectors return every face as (x, y, w, h) at least min_size pixels wide.
+# They get the grayscale frame, plus the color frame when needs_color is set.
+
+
+class HaarDetector:
+    name = 'haar'
+    needs_color = False
+
+    def __init__(self):
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def faces(self, frame, gray, min_size):
+        return self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+
+
+def find_model_file(filename):
+    # Our own models directory first, then files DeepFace already downloaded
+    for directory in (DEFAULT_MODEL_DIR, DEEPFACE_WEIGHTS):
+        if (directory / filename).exists():
+            return directory / filename
+    raise FileNotFoundError(f"{filename} not found in {DEFAULT_MODEL_DIR}/ or {DEEPFACE_WEIGHTS}/")
+
+
+class DnnDetector:
+    # OpenCV's ResNet-10 SSD face detector from samples/dnn/face_detector
+    name = 'dnn'
+    needs_color = True
+
+    def __init__(self, confidence=0.5):
+        self.net = cv2.dnn.readNetFromCaffe(str(find_model_file('deploy.prototxt')),
+                                            str(find_model_file('res10_300x300_ssd_iter_140000.caffemodel')))
+        self.confidence = confidence
+
+    def faces(self, frame, gray, min_size):
+        height, width = frame.shape[:2]
+        self.net.setInput(cv2.dnn.blobFromImage(frame, 1.0, (300, 300), (104.0, 177.0, 123.0)))
+        detections = self.net.forward()[0, 0]
+        found = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            x0, y0, x1, y1 = (detection[3:7] * [width, height, width, height]).astype(int)
+            x0, y0 = max(0, x0), max(0, y0)
+            w, h = min(width, x1) - x0, min(height, y1) - y0
+            if w >= min_size and h >= min_size:
+                found.append((x0, y0, w, h))
+        return found
+
+
+class YuNetDetector:
+    # OpenCV's YuNet face detector from the opencv_zoo
+    name = 'yunet'
+    needs_color = True
+
+    def __init__(self, confidence=0.6):
+        self.detector = cv2.FaceDetectorYN.create(str(find_model_file('face_detection_yunet_2023mar.onnx')),
+                                                  '', (320, 320), confidence)
+        self.size = None
+
+    def faces(self, frame, gray, min_size):
+        size = (frame.shape[1], frame.shape[0])
+        if size != self.size:
+            self.detector.setInputSize(size)
+            self.size = size
+        _, detections = self.detector.detect(frame)
+        if detections is None:
+            return []
+        return [tuple(int(v) for v in d[:4]) for d in detections if d[2] >= min_size and d[3] >= min_size]
+
+
+class DeepFaceDetector:
+    # Any of DeepFace's detector backends, through extract_faces
+    needs_color = True
+
+    def __init__(self, backend):
+        from deepface import DeepFace
+        self.extract_faces = DeepFace.extract_faces
+        self.backend = backend
+        self.name = f'deepface-{backend}'
+
+    def faces(self, frame, gray, min_size):
+        found = []
+        for face in self.extract_faces(frame, detector_backend=self.backend, enforce_detection=False,
+                                       align=False):
+            # With enforce_detection off, "no face" comes back as the whole frame at confidence 0
+            if not face.get('confidence'):
+                continue
+            area = face['facial_area']
+            if area['w'] >= min_size and area['h'] >= min_size:
+                found.append((area['x'], area['y'], area['w'], area['h']))
+        return found
+
+
+def detector_names():
+    return ['haar', 'dnn', 'yunet'] + [f'deepface-{b}' for b in DEEPFACE_BACKENDS]
+
+
+def create_detector(name):
+    if name == 'haar':
+        return HaarDetector()
+    if name == 'dnn':
+        return DnnDetector()
+    if name == 'yunet':
+        return YuNetDetector()
+    if name.startswith('deepface-'):
+        return DeepFaceDetector(name[len('deepface-'):])
+    raise ValueError(f"Unknown face detector: {name}")
+
+
+def default_profile_path():
+    return DEFAULT_PROFILE_DIR / f'detectors_{socket.gethostname()}.json'
+
+
+def load_frames(path, count):
+    cap = cv2.VideoCapture(str(path))
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video file: {path}")
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise ValueError(f"No frames in {path}")
+    return frames
+
+
+def measure(name, frames, inference_scale):
+    from face_tracker import FaceTracker
+
+    try:
+        tracker = FaceTracker(detector=create_detector(name), detect_scale=inference_scale)
+        # The first call loads weights and builds graphs, keep it out of the timings
+        tracker.locate(frames[0])
+    except Exception as e:
+        return {'available': False, 'error': f"{type(e).__name__}: {e}"}
+
+    times, hits = [], 0
+    for frame in frames:
+        start = time.perf_counter()
+        box = tracker.locate(frame)
+        times.append(1000 * (time.perf_counter() - start))
+        hits += box is not None
+    p50, p95 = np.percentile(times, [50, 95])
+    return {'available': True, 'mean_ms': float(np.mean(times)), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'hit_rate': hits / len(frames)}
+
+
+def calibrate(clip, names=None, frames=200, inference_scale=1.0):
+    clip_frames = load_frames(clip, frames)
+    profile = {
+        'host': socket.gethostname(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'clip': str(clip),
+        'frames': len(clip_frames),
+        'frame_size': [clip_frames[0].shape[1], clip_frames[0].shape[0]],
+        'inference_scale': inference_scale,
+        'opencv': cv2.__version__,
+        'backends': {},
+    }
+    for name in names or detector_names():
+        print(f"Measuring {name}...", flush=True)
+        profile['backends'][name] = measure(name, clip_frames, inference_scale)
+    return profile
+
+
+def choose_detector(profile, min_detection_rate=0.9):
+    # Fastest backend that finds a face often enough, else the one that finds the most
+    available = {name: r for name, r in profile['backends'].items() if r['available']}
+    if not available:
+        return None
+    good = [name for name, r in available.items() if r['hit_rate'] >= min_detection_rate]
+    if good:
+        return min(good, key=lambda name: available[name]['mean_ms'])
+    return max(available, key=lambda name: (available[name]['hit_rate'], -available[name]['mean_ms']))
+
+
+def pick_detector(name='auto', profile_path=None, min_detection_rate=0.9):
+    # The detector to use plus a line saying why
+    if name != 'auto':
+        return create_detector(name), f"Face detector: {name}"
+
+    path = Path(profile_path) if profile_path else default_profile_path()
+    if not path.exists():
+        return HaarDetector(), f"Face detector: haar (no calibration profile at {path})"
+    profile = json.loads(path.read_text())
+    chosen = choose_detector(profile, min_detection_rate)
+    if chosen is None:
+        return HaarDetector(), f"Face detector: haar (no usable backend in {path})"
+    try:
+        detector = create_detector(chosen)
+    except Exception as e:
+        return HaarDetector(), f"Face detector: haar ({chosen} from {path} failed to load: {e})"
+    result = profile['backends'][chosen]
+    note = '' if result['hit_rate'] >= min_detection_rate else f", none reached {min_detection_rate:.0%}"
+    return detector, (f"Face detector: {chosen} ({result['mean_ms']:.1f} ms, {result['hit_rate']:.0%} "
+                      f"hit rate{note}, from {path})")
+
+
+def print_profile(profile, min_detection_rate):
+    chosen = choose_detector(profile, min_detection_rate)
+    print(f"\n{profile['frames']} frames of {profile['frame_size'][0]}x{profile['frame_size'][1]} "
+          f"at inference scale {profile['inference_scale']} on {profile['host']}")
+    header = f"  {'backend':<22}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'hit rate':>10}"
+    print(header)
+    print('  ' + '-' * (len(header) - 2))
+    for name, r in profile['backends'].items():
+        marker = '*' if name == chosen else ' '
+        if r['available']:
+            print(f"{marker} {name:<22}{r['mean_ms']:>9.2f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['hit_rate']:>10.0%}")
+        else:
+            print(f"{marker} {name:<22}unavailable: {r['error'][:80]}")
+    if chosen is not None:
+        if profile['backends'][chosen]['hit_rate'] >= min_detection_rate:
+            print(f"\n* chosen for a minimum detection rate of {min_detection_rate:.0%}")
+        else:
+            print(f"\n* no backend reached {min_detection_rate:.0%}, chosen for the highest hit rate")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate face detector backends on this machine")
+    parser.add_argument('command', choices=['calibrate', 'show'])
+    parser.add_argument('--clip', help="recorded video with a face in most frames")
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--backends', help="comma-separated subset of: " + ', '.join(detector_names()))
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="measure at the inference scale the matcher will run with")
+    parser.add_argument('--profile', help=f"profile file, default {default_profile_path()}")
+    parser.add_argument('--min-detection-rate', type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    path = Path(args.profile) if args.profile else default_profile_path()
+    if args.command == 'show':
+        if not path.exists():
+            print(f"No profile at {path}")
+            return 1
+        print_profile(json.loads(path.read_text()), args.min_detection_rate)
+        return 0
+
+    if not args.clip:
+        parser.error("calibrate needs --clip")
+    try:
+        profile = calibrate(args.clip, args.backends.split(',') if args.backends else None, args.frames,
+                            args.inference_scale)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(profile, indent=2))
+    print_profile(profile, args.min_detection_rate)
+    print(f"Saved {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import cv2
+
+from face_detectors import HaarDetector
+
+
+class FaceTracker:
+    # Full detection (Haar cascade unless another detector is given) every
+    # redetect_interval frames, cheap template matching around the last box in between
+    def __init__(self, redetect_interval=15, crop_size=112, match_threshold=0.6,
+                 search_margin=0.5, min_face_size=48, detect_scale=1.0, detector=None):
+        self.detector = detector if detector is not None else HaarDetector()
+        self.redetect_interval = redetect_interval
+        self.crop_size = crop_size
+        self.match_threshold = match_threshold
+        self.search_margin = search_margin
+        self.min_face_size = min_face_size
+        self.detect_scale = detect_scale
+        self.box = None
+        self.template = None
+        self.frames_since_detect = 0
+        self.detections = 0
+        self.tracked = 0
+        self.lost = 0
+
+    def set_detect_scale(self, scale):
+        # The tracked box and template are in detection coordinates, start over
+        if scale != self.detect_scale:
+            self.detect_scale = scale
+            self.box = None
+            self.template = None
+
+    def detection_gray(self, frame):
+        # Detection and tracking run on a downscaled gray copy
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.detect_scale < 1:
+            gray = cv2.resize(gray, (max(1, round(gray.shape[1] * self.detect_scale)),
+                                     max(1, round(gray.shape[0] * self.detect_scale))),
+                              interpolation=cv2.INTER_AREA)
+        return gray
+
+    def to_frame(self, box, frame):
+        # Detection coordinates back to the full-resolution frame
+        if box is None or self.detect_scale >= 1:
+            return box
+        x, y, w, h = (round(v / self.detect_scale) for v in box)
+        x, y = min(x, frame.shape[1] - 1), min(y, frame.shape[0] - 1)
+        return x, y, min(w, frame.shape[1] - x), min(h, frame.shape[0] - y)
+
+    def locate(self, frame):
+        # Full detection without tracking, as a full-resolution box
+        return self.to_frame(self.detect(self.detection_gray(frame), frame), frame)
+
+    def detect(self, gray, frame=None):
+        # Detectors that work on color get the full-resolution frame scaled like gray
+        color = None
+        if self.detector.needs_color:
+            color = frame
+            if color.shape[:2] != gray.shape[:2]:
+                color = cv2.resize(frame, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_AREA)
+        # 24 px is the smallest face the cascade was trained on
+        min_size = self.min_face_size
+        if self.detect_scale < 1:
+            min_size = max(24, round(min_size * self.detect_scale))
+        faces = self.detector.faces(color, gray, min_size)
+        self.detections += 1
+        # Some backends return boxes reaching past the frame edge, an empty crop
+        # would break the template match, so clip them here for every backend
+        height, width = gray.shape[:2]
+        boxes = []
+        for x, y, w, h in faces:
+            x0, y0 = max(0, int(x)), max(0, int(y))
+            x1, y1 = min(width, int(x + w)), min(height, int(y + h))
+            if x1 > x0 and y1 > y0:
+                boxes.append((x0, y0, x1 - x0, y1 - y0))
+        if not boxes:
+            return None
+        # The largest face is the one closest to the camera
+        return max(boxes, key=lambda f: f[2] * f[3])
+
+    def track(self, gray):
+        x, y, w, h = self.box
+        mx, my = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(gray.shape[1], x + w + mx), min(gray.shape[0], y + h + my)
+        region = gray[y0:y1, x0:x1]
+        if region.shape[0] < h or region.shape[1] < w:
+            return None
+
+        scores = cv2.matchTemplate(region, self.template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+        if best < self.match_threshold:
+            return None
+        return x0 + bx, y0 + by, w, h
+
+    def update(self, frame):
+        gray = self.detection_gray(frame)
+
+        box = None
+        if self.box is not None and self.frames_since_detect < self.redetect_interval:
+            box = self.track(gray)
+            if box is not None:
+                self.tracked += 1
+            else:
+                self.lost += 1
+
+        if box is None:
+            box = self.detect(gray, frame)
+            self.frames_since_detect = 0
+        else:
+            self.frames_since_detect += 1
+
+        self.box = box
+        if box is not None:
+            x, y, w, h = box
+            self.template = gray[y:y + h, x:x + w].copy()
+        return self.to_frame(box, frame)
+
+    def crop(self, frame, box):
+        x, y, w, h = box
+        face = frame[y:y + h, x:x + w]
+        scale = self.crop_size / max(w, h)
+        if scale < 1:
+            return cv2.resize(face, (max(1, int(w * scale)), max(1, int(h * scale))),
+                              interpolation=cv2.INTER_AREA)
+        return face.copy()
+
+    def summary(self):
+        return (f"Face tracking ({self.detector.name}): {self.detections} full detections, "
+                f"{self.tracked} tracked frames, {self.lost} times lost")
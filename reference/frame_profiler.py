@@ -0,0 +1,135 @@
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+SECTIONS = ['capture', 'detection', 'compose']
+
+
+class FrameProfiler:
+    # Profiles the next N frames of the run loop on request. Each section of the
+    # loop gets its own cProfile over every frame, and a tally of the memory it
+    # allocated and still holds when the section ends. Snapshots are slow, so
+    # allocations are only compared on alloc_samples frames spread over the
+    # capture. Between captures nothing is enabled, and the loop only checks
+    # the active flag.
+    def __init__(self, frames=300, output_dir='output', top=20, alloc_samples=20):
+        self.frames = frames
+        self.output_dir = Path(output_dir)
+        self.top = top
+        self.alloc_every = max(1, frames // alloc_samples)
+        self.active = False
+        self.section = None
+        self.before = None
+        self.captures = []
+
+    def start(self):
+        if self.active:
+            return
+        self.profiles = {name: cProfile.Profile() for name in SECTIONS}
+        self.allocated = {name: Counter() for name in SECTIONS}
+        self.peaks = dict.fromkeys(SECTIONS, 0)
+        # A capture can end before every section ran, e.g. when the source runs out
+        self.entered = set()
+        # Leave tracemalloc running afterwards if someone else started it
+        self.own_tracemalloc = not tracemalloc.is_tracing()
+        if self.own_tracemalloc:
+            tracemalloc.start()
+        # Our own snapshots are allocated inside the sections, don't count them
+        self.ignored = {tracemalloc.__file__, __file__}
+        self.stamp = time.strftime('%Y%m%d_%H%M%S')
+        self.started = time.perf_counter()
+        self.profiled = 0
+        self.sampled = 0
+        self.active = True
+        print(f"Profiling the next {self.frames} frames...")
+
+    def enter(self, section):
+        self._leave()
+        self.section = section
+        self.entered.add(section)
+        if self.profiled % self.alloc_every == 0:
+            self.before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+        self.profiles[section].enable()
+
+    def _leave(self):
+        if self.section is None:
+            return
+        self.profiles[self.section].disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peaks[self.section] = max(self.peaks[self.section], peak - self.base)
+        if self.before is not None:
+            for stat in tracemalloc.take_snapshot().compare_to(self.before, 'lineno'):
+                if stat.size_diff > 0 and stat.traceback[0].filename not in self.ignored:
+                    self.allocated[self.section][stat.traceback[0]] += stat.size_diff
+            self.before = None
+        self.section = None
+
+    def end_frame(self):
+        self._leave()
+        if self.profiled % self.alloc_every == 0:
+            self.sampled += 1
+        self.profiled += 1
+        if self.profiled >= self.frames:
+            self.finish()
+
+    def finish(self):
+        if not self.active:
+            return
+        self._leave()
+        elapsed = time.perf_counter() - self.started
+        if self.own_tracemalloc:
+            tracemalloc.stop()
+        self.active = False
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base = self.output_dir / f'profile_{self.stamp}'
+        report = io.StringIO()
+        report.write(f"{self.profiled} frames profiled in {elapsed:.2f} s\n")
+        console = [f"Profile of {self.profiled} frames saved to {base}.txt"]
+        for name in SECTIONS:
+            if name not in self.entered:
+                report.write(f"\n=== {name}: not reached ===\n")
+                continue
+            profile = self.profiles[name]
+            profile.dump_stats(f'{base}_{name}.prof')
+            stats = pstats.Stats(profile, stream=report)
+            report.write(f"\n=== {name}: {stats.total_tt:.3f} s, "
+                         f"{stats.total_tt * 1000 / max(1, self.profiled):.2f} ms per frame ===\n")
+            if stats.total_tt:
+                stats.sort_stats('tottime').print_stats(self.top)
+            sites = self.allocated[name].most_common(self.top)
+            report.write(f"Peak memory within the section: {self.peaks[name] / 1024:.1f} KiB\n"
+                         f"Allocation sites still holding memory when the section ended "
+                         f"(total over {self.sampled} sampled frames):\n")
+            for site, size in sites:
+                report.write(f"  {size / 1024:10.1f} KiB  {site.filename}:{site.lineno}\n")
+            console.append(f"  {name:<10} {stats.total_tt * 1000 / max(1, self.profiled):7.2f} ms/frame  "
+                           f"top: {top_function(stats)}  alloc: {top_site(sites)}")
+        Path(f'{base}.txt').write_text(report.getvalue())
+        self.captures.append(f'{base}.txt')
+        self.profiles = None
+        self.allocated = None
+        print('\n'.join(console))
+
+    def summary(self):
+        return f"Profiles: {', '.join(self.captures)}"
+
+
+def top_function(stats):
+    if not stats.stats:
+        return '-'
+    func, (_, _, tottime, _, _) = max(stats.stats.items(), key=lambda item: item[1][2])
+    return f"{pstats.func_std_string(func)} ({tottime * 1000:.0f} ms)"
+
+
+def top_site(sites):
+    if not sites:
+        return '-'
+    site, size = sites[0]
+    return f"{Path(site.filename).name}:{site.lineno} ({size / 1024:.0f} KiB)"
@@ -0,0 +1,191 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class WindowSink:
+    def __init__(self, window_name='Expression Matcher'):
+        self.window_name = window_name
+
+    def show(self, frame):
+        cv2.imshow(self.window_name, frame)
+
+    def poll_key(self):
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class HeadlessSink:
+    # No window, the frames are only counted
+    def __init__(self):
+        self.total_frames = 0
+
+    def show(self, frame):
+        self.total_frames += 1
+
+    def poll_key(self):
+        return -1
+
+    def close(self):
+        print(f"Processed {self.total_frames} frames")
+
+
+def same_frame(a, b, rows=64):
+    # Compared in bands of rows: the comparison buffer stays small, and a
+    # changed frame usually differs in the first band
+    if a.shape != b.shape:
+        return False
+    for y in range(0, a.shape[0], rows):
+        if not np.array_equal(a[y:y + rows], b[y:y + rows]):
+            return False
+    return True
+
+
+class MjpegSink:
+    # Serves the composited view as an MJPEG stream on localhost. show() only
+    # compares and copies the frame, JPEG encoding happens on a small thread
+    # pool and every client thread sends the newest encoded frame, so a slow
+    # viewer skips frames instead of holding up the loop or other viewers.
+    def __init__(self, port=8080, host='127.0.0.1', quality=80, encode_workers=2):
+        self.quality = quality
+        self.encode_workers = encode_workers
+        self.pool = ThreadPoolExecutor(encode_workers, thread_name_prefix='mjpeg-encode')
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._last = None
+        self._in_flight = 0
+        self._pending = None
+        self._submitted = 0
+        self._published = 0
+        self.jpeg = None
+        self.closed = False
+        self.clients = 0
+        self.total_frames = 0
+        self.encoded = 0
+        self.unchanged = 0
+        self.superseded = 0
+        self.idle = 0
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/':
+                    self.send_page()
+                elif self.path == '/stream':
+                    sink.stream_to(self)
+                elif self.path == '/frame.jpg':
+                    self.send_frame()
+                else:
+                    self.send_error(404)
+
+            def send_page(self):
+                body = b'<html><body style="margin:0;background:#000"><img src="/stream"></body></html>'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_frame(self):
+                jpeg = sink.jpeg
+                if jpeg is None:
+                    self.send_error(503)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(jpeg)))
+                self.end_headers()
+                self.wfile.write(jpeg)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mjpeg-server', daemon=True)
+        self.thread.start()
+        print(f"Streaming on http://{host}:{self.server.server_address[1]}/")
+
+    def show(self, frame):
+        self.total_frames += 1
+        with self._lock:
+            if self.clients == 0:
+                # Nobody is watching, don't spend CPU on encoding
+                self.idle += 1
+                self._last = None
+                return
+            if self._last is not None and same_frame(self._last, frame):
+                self.unchanged += 1
+                return
+            # The caller reuses its canvas, the encoder needs its own copy
+            self._last = frame.copy()
+            self._submitted += 1
+            job = (self._last, self._submitted)
+            if self._in_flight >= self.encode_workers:
+                # All encoders busy: keep only the newest waiting frame
+                if self._pending is not None:
+                    self.superseded += 1
+                self._pending = job
+                return
+            self._in_flight += 1
+        self.pool.submit(self._encode, job)
+
+    def _encode(self, job):
+        while job is not None:
+            frame, number = job
+            ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            with self._cond:
+                self.encoded += 1
+                # Encoders can finish out of order, never go back to an older frame
+                if ok and number > self._published:
+                    self._published = number
+                    self.jpeg = jpeg.tobytes()
+                    self._cond.notify_all()
+                job, self._pending = self._pending, None
+                if job is None:
+                    self._in_flight -= 1
+
+    def stream_to(self, handler):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.end_headers()
+        with self._cond:
+            self.clients += 1
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.closed or self._published > seen, timeout=1.0)
+                    if self.closed:
+                        return
+                    if self._published <= seen:
+                        continue
+                    seen, jpeg = self._published, self.jpeg
+                handler.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                                    + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                handler.wfile.flush()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+    def poll_key(self):
+        return -1
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.shutdown()
+        print(f"Streamed {self.total_frames} frames: {self.encoded} encoded, {self.unchanged} unchanged, "
+              f"{self.superseded} superseded while encoders were busy, {self.idle} with no viewer")
@@ -0,0 +1,200 @@
+import threading
+
+import cv2
+import numpy as np
+from pathlib import Path
+
+IMAGE_SUFFIXES = ['.png', '.jpg', '.jpeg']
+
+
+class CameraSource:
+    def __init__(self, index=0, size=None, fps=None, buffer_size=None):
+        self.cap = cv2.VideoCapture(index)
+        if size is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        if fps is not None:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size is not None:
+            # A small driver buffer means fewer stale frames after a slow loop iteration
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        if size is not None or fps is not None:
+            print(f"Camera {index}: {int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+                  f"{int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} at {self.cap.get(cv2.CAP_PROP_FPS):g} fps")
+
+    def read(self, out=None):
+        # OpenCV decodes into `out` when it has the right shape
+        return self.cap.read(out)
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource:
+    def __init__(self, path, loop=False):
+        self.path = str(path)
+        self.loop = loop
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video file: {self.path}")
+
+    def read(self, out=None):
+        ret, frame = self.cap.read(out)
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(out)
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource:
+    def __init__(self, directory, loop=False):
+        self.files = sorted(f for f in Path(directory).iterdir()
+                            if f.suffix.lower() in IMAGE_SUFFIXES)
+        if not self.files:
+            raise ValueError(f"No images found in {directory}")
+        self.loop = loop
+        self.index = 0
+
+    def read(self, out=None):
+        if self.index >= len(self.files):
+            if not self.loop:
+                return False, None
+            self.index = 0
+        frame = cv2.imread(str(self.files[self.index]))
+        self.index += 1
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+class SyntheticSource:
+    # Gradient background with a moving bright disc, no camera or files needed
+    def __init__(self, width=640, height=480, count=None):
+        self.width = width
+        self.height = height
+        self.count = count
+        self.index = 0
+        ramp = np.linspace(40, 200, width, dtype=np.uint8)
+        self.background = np.repeat(np.tile(ramp, (height, 1))[:, :, None], 3, axis=2)
+
+    def read(self, out=None):
+        if self.count is not None and self.index >= self.count:
+            return False, None
+        frame = self.background.copy()
+        t = self.index / 30.0
+        center = (int(self.width / 2 + self.width / 4 * np.sin(t)),
+                  int(self.height / 2 + self.height / 6 * np.cos(t * 0.7)))
+        cv2.circle(frame, center, self.height // 5, (180, 200, 230), -1)
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class ThreadedGrabber:
+    # Reads a source on its own thread into a fixed pool of frame buffers.
+    # read() returns the newest frame, frames the loop was too slow to pick
+    # up are dropped and their buffer reused. A returned frame stays valid
+    # until the next read().
+    def __init__(self, source, buffers=3):
+        # One buffer is held by the loop while the thread fills another
+        if buffers < 2:
+            raise ValueError(f"the capture thread needs at least 2 frame buffers, got {buffers}")
+        self.source = source
+        self.buffers = buffers
+        self.allocated = 0
+        self.free = []
+        self.latest = None
+        self.held = None
+        self.ended = False
+        self.running = True
+        self._cond = threading.Condition()
+        self.grabbed = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.starved = 0
+        self._thread = threading.Thread(target=self._loop, name='capture-grabber', daemon=True)
+        self._thread.start()
+
+    def _take_buffer(self):
+        with self._cond:
+            if not self.free and self.allocated >= self.buffers:
+                # Every buffer is in use, a bigger pool would have avoided the wait
+                self.starved += 1
+                self._cond.wait_for(lambda: self.free or not self.running)
+            if not self.running:
+                return False, None
+            if self.free:
+                return True, self.free.pop()
+            # The source allocates the first frame of each buffer
+            self.allocated += 1
+            return True, None
+
+    def _loop(self):
+        while True:
+            ok, buffer = self._take_buffer()
+            if not ok:
+                return
+            ret, frame = self.source.read(buffer)
+            with self._cond:
+                if not ret:
+                    self.ended = True
+                    self._cond.notify_all()
+                    return
+                self.grabbed += 1
+                if self.latest is not None:
+                    self.dropped += 1
+                    self.free.append(self.latest)
+                self.latest = frame
+                self._cond.notify_all()
+
+    def read(self, out=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self.latest is not None or self.ended or not self.running)
+            if self.latest is None:
+                return False, None
+            if self.held is not None:
+                self.free.append(self.held)
+            self.held, self.latest = self.latest, None
+            self.delivered += 1
+            self._cond.notify_all()
+            return True, self.held
+
+    def release(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        self._thread.join()
+        self.source.release()
+
+    def summary(self):
+        dropped = 100 * self.dropped / self.grabbed if self.grabbed else 0
+        return (f"Capture thread: {self.grabbed} frames grabbed, {self.delivered} delivered, "
+                f"{self.dropped} dropped ({dropped:.0f}%), waited for a free buffer {self.starved} times "
+                f"({self.allocated} of {self.buffers} buffers used)")
+
+
+def open_source(spec, loop=False, capture_size=None, capture_fps=None, capture_buffer_size=None,
+                grab_buffers=3):
+    # camera[:index], synthetic[:WxH[:count]], an image directory or a video file.
+    # Cameras are read on their own thread unless grab_buffers is 0.
+    if spec == 'camera' or spec.startswith('camera:'):
+        index = int(spec.split(':', 1)[1]) if ':' in spec else 0
+        camera = CameraSource(index, capture_size, capture_fps, capture_buffer_size)
+        return ThreadedGrabber(camera, grab_buffers) if grab_buffers > 0 else camera
+    if spec == 'synthetic' or spec.startswith('synthetic:'):
+        parts = spec.split(':')[1:]
+        width, height = (int(v) for v in parts[0].split('x')) if parts else (640, 480)
+        count = int(parts[1]) if len(parts) > 1 else None
+        return SyntheticSource(width, height, count)
+    path = Path(spec)
+    if path.is_dir():
+        return ImageDirectorySource(path, loop=loop)
+    if path.exists():
+        return VideoFileSource(path, loop=loop)
+    raise ValueError(f"Unknown frame source: {spec}")
@@ -0,0 +1,121 @@
+import threading
+from collections import deque
+from pathlib import Path
+
+import cv2
+
+DROP_POLICIES = ['drop-newest', 'drop-oldest', 'block']
+
+
+class FrameWriter:
+    # Snapshots and video recording on a background thread. Recorded frames
+    # go through a bounded queue; when the disk falls behind, drop_policy
+    # decides whether new frames are dropped, the oldest queued frames are
+    # dropped, or the caller waits. Snapshots are never dropped.
+    def __init__(self, max_queue=64, drop_policy='drop-newest'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.queued_frames = 0
+        self.recording = False
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.snapshots = 0
+        self._running = True
+        self._video = None
+        self._thread = threading.Thread(target=self._loop, name='frame-writer', daemon=True)
+        self._thread.start()
+
+    def snapshot(self, frame, path):
+        self._put(('snapshot', frame.copy(), Path(path)))
+
+    def start_recording(self, path, fps, size):
+        self._put(('open', Path(path), fps, size))
+        self.recording = True
+
+    def stop_recording(self):
+        if self.recording:
+            self.recording = False
+            self._put(('close',))
+
+    def record(self, frame):
+        with self.cond:
+            if self.queued_frames >= self.max_queue:
+                if self.drop_policy == 'drop-newest':
+                    self.dropped += 1
+                    return
+                if self.drop_policy == 'drop-oldest':
+                    self._drop_oldest_frame()
+                else:
+                    while self.queued_frames >= self.max_queue and self._running:
+                        self.cond.wait()
+            self.items.append(('frame', frame.copy()))
+            self.queued_frames += 1
+            self.queued += 1
+            self.cond.notify_all()
+
+    def _drop_oldest_frame(self):
+        for i, item in enumerate(self.items):
+            if item[0] == 'frame':
+                del self.items[i]
+                self.queued_frames -= 1
+                self.dropped += 1
+                return
+
+    def _put(self, item):
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.items and self._running:
+                    self.cond.wait()
+                if not self.items:
+                    return
+                item = self.items.popleft()
+                if item[0] == 'frame':
+                    self.queued_frames -= 1
+                self.cond.notify_all()
+
+            kind = item[0]
+            if kind == 'frame':
+                if self._video is not None:
+                    self._video.write(item[1])
+                    self.written += 1
+            elif kind == 'snapshot':
+                _, frame, path = item
+                path.parent.mkdir(parents=True, exist_ok=True)
+                cv2.imwrite(str(path), frame)
+                self.snapshots += 1
+                print(f"Saved: {path}")
+            elif kind == 'open':
+                _, path, fps, size = item
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._video = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+                print(f"Recording to {path}")
+            elif kind == 'close':
+                self._close_video()
+
+    def _close_video(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def close(self):
+        # Writes everything still queued, then stops the thread
+        self.stop_recording()
+        with self.cond:
+            self._running = False
+            self.cond.notify_all()
+        self._thread.join()
+        self._close_video()
+
+    def summary(self):
+        return (f"Writer: {self.queued} frames queued, {self.written} written, {self.dropped} dropped "
+                f"({self.drop_policy}), {self.snapshots} snapshots")
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ALIGNMENT = 64
+
+
+class ByteBudgetLRU:
+    # Dict-like cache of arrays that evicts least recently used entries once
+    # their total size passes max_bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        value = self.entries.get(key)
+        if value is None:
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key).nbytes
+        if value.nbytes > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.bytes += value.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+
+def referenced_images(mapping):
+    names = []
+    for images in mapping.values():
+        for name in images:
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def source_state(image_directory, names):
+    # What the atlas was built from: every referenced file with its mtime and size
+    state = {}
+    for name in names:
+        path = Path(image_directory) / name
+        if path.exists():
+            stat = path.stat()
+            state[name] = [stat.st_mtime_ns, stat.st_size]
+    return state
+
+
+class ImageAtlas:
+    # Every image referenced by the expression mapping, decoded once into a
+    # single file and memory-mapped so lookups are zero-copy views
+    def __init__(self, data_path, index):
+        self.index = index
+        if os.path.getsize(data_path):
+            self.data = np.memmap(data_path, dtype=np.uint8, mode='r')
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __contains__(self, name):
+        return name in self.index['images']
+
+    def get(self, name):
+        entry = self.index['images'].get(name)
+        if entry is None:
+            return None
+        offset, shape = entry['offset'], tuple(entry['shape'])
+        return self.data[offset:offset + int(np.prod(shape))].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @classmethod
+    def open(cls, mapping, image_directory, atlas_directory=None):
+        # Rebuilds the atlas first if any referenced file was added, removed or modified
+        image_directory = Path(image_directory)
+        atlas_directory = Path(atlas_directory) if atlas_directory else image_directory / '.atlas'
+        data_path, index_path = atlas_directory / 'atlas.bin', atlas_directory / 'atlas.json'
+
+        state = source_state(image_directory, referenced_images(mapping))
+        index = None
+        if data_path.exists() and index_path.exists():
+            with open(index_path) as f:
+                index = json.load(f)
+            if index.get('sources') != state:
+                index = None
+        if index is None:
+            index = build_atlas(image_directory, state, data_path, index_path)
+        return cls(data_path, index)
+
+
+def build_atlas(image_directory, state, data_path, index_path):
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    images = {}
+    offset = 0
+    tmp_path = data_path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        for name in state:
+            img = cv2.imread(str(Path(image_directory) / name))
+            if img is None:
+                continue
+            img = np.ascontiguousarray(img)
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            f.write(img.tobytes())
+            images[name] = {'offset': offset, 'shape': list(img.shape)}
+            offset += img.nbytes
+    os.replace(tmp_path, data_path)
+
+    index = {'sources': state, 'images': images}
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    print(f"Built image atlas with {len(images)} images ({offset / 2 ** 20:.1f} MiB) in {data_path.parent}")
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-decode the character images into a memory-mapped atlas")
+    parser.add_argument('--mapping', default='expressions.json')
+    parser.add_argument('--images', default='images')
+    args = parser.parse_args(argv)
+
+    with open(args.mapping) as f:
+        mapping = json.load(f)
+    atlas = ImageAtlas.open(mapping, args.images)
+    print(f"Atlas holds {len(atlas.index['images'])} images, {atlas.nbytes / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
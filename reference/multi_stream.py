@@ -0,0 +1,216 @@
+import argparse
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+
+from emotion_model import EmotionModel
+from expression_matcher import ExpressionMatcher
+from face_tracker import FaceTracker
+from frame_sinks import HeadlessSink, MjpegSink, WindowSink
+from frame_sources import ThreadedGrabber, open_source
+from perf_stats import ConsoleExporter, StageStats, draw_hud
+from result_cache import EmotionResultCache, perceptual_hash
+
+
+def tile_frames(frames, columns, canvas=None):
+    cell_h = max(f.shape[0] for f in frames)
+    cell_w = max(f.shape[1] for f in frames)
+    rows = math.ceil(len(frames) / columns)
+    shape = (rows * cell_h, columns * cell_w, 3)
+    if canvas is None or canvas.shape != shape:
+        canvas = np.zeros(shape, dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        y, x = (i // columns) * cell_h, (i % columns) * cell_w
+        canvas[y:y + frame.shape[0], x:x + frame.shape[1]] = frame
+    return canvas
+
+
+class MultiStreamMatcher:
+    # Drives several frame sources from one process. Face crops due for
+    # analysis on every stream go through the emotion model in one batch.
+    def __init__(self, sources, expression_mapping_file='expressions.json', image_directory='images',
+                 model=None, tiled=True, headless=False, max_frames=None, result_cache=None,
+                 stats=None, hud=False, stream_port=None, inference_scale=1.0):
+        self.model = model if model is not None else EmotionModel()
+        self.streams = [ExpressionMatcher(expression_mapping_file, image_directory,
+                                          source=source, sink=HeadlessSink(), model=self.model,
+                                          tracker=FaceTracker(detect_scale=inference_scale),
+                                          use_atlas=i == 0)
+                        for i, source in enumerate(sources)]
+        # One decoded image cache and atlas for all streams
+        for stream in self.streams[1:]:
+            stream.image_cache = self.streams[0].image_cache
+            stream.atlas = self.streams[0].atlas
+
+        self.result_cache = result_cache
+        self.stats = stats if stats is not None or not hud else StageStats()
+        self.hud = hud
+        self.tiled = tiled
+        self.max_frames = max_frames
+        if stream_port is not None:
+            # One stream for the tiled view, or consecutive ports per stream
+            count = 1 if tiled else len(self.streams)
+            self.sinks = [MjpegSink(stream_port + i) for i in range(count)]
+        elif headless:
+            self.sinks = [HeadlessSink()]
+        elif tiled:
+            self.sinks = [WindowSink('Expression Matcher')]
+        else:
+            self.sinks = [WindowSink(f'Expression Matcher {i}') for i in range(len(self.streams))]
+        self.batches = 0
+        self.faces_classified = 0
+
+    def apply_cached(self, pending, now):
+        # Streams whose face matches a cached result skip the batch
+        misses = []
+        for stream, face, _ in pending:
+            face_hash = perceptual_hash(face)
+            scores = self.result_cache.lookup(face_hash, now)
+            if scores is not None:
+                stream.apply_scores(scores, now)
+            else:
+                misses.append((stream, face, face_hash))
+        return misses
+
+    def run(self):
+        print(f"Expression Matcher running {len(self.streams)} streams! Press 'q' to quit\n")
+        active = [True] * len(self.streams)
+        frames = [None] * len(self.streams)
+        displays = [None] * len(self.streams)
+        columns = math.ceil(math.sqrt(len(self.streams)))
+        tile_canvas = None
+        frame_count = 0
+
+        # Ctrl-C stops a streamed or headless session, the sinks still need closing
+        try:
+            while any(active) and (self.max_frames is None or frame_count < self.max_frames):
+                start = time.perf_counter()
+                for i, stream in enumerate(self.streams):
+                    if active[i]:
+                        ret, frame = stream.source.read()
+                        if ret:
+                            frames[i] = frame
+                        else:
+                            active[i] = False
+                if not any(active):
+                    break
+                capture_done = time.perf_counter()
+
+                # Gather the crops that are due on every stream into one batch
+                pending = []
+                for i, stream in enumerate(self.streams):
+                    if not active[i]:
+                        continue
+                    face_box = stream.tracker.update(frames[i])
+                    if face_box is not None and stream.scheduler.should_analyze(frames[i], capture_done):
+                        pending.append((stream, stream.tracker.crop(frames[i], face_box), None))
+                if self.result_cache is not None:
+                    pending = self.apply_cached(pending, capture_done)
+                if pending:
+                    results = self.model.scores([face for _, face, _ in pending])
+                    for (stream, _, face_hash), scores in zip(pending, results):
+                        stream.apply_scores(scores, capture_done)
+                        if face_hash is not None:
+                            self.result_cache.store(face_hash, scores, capture_done)
+                    self.batches += 1
+                    self.faces_classified += len(pending)
+                detect_done = time.perf_counter()
+
+                for i, stream in enumerate(self.streams):
+                    if frames[i] is None:
+                        continue
+                    if active[i]:
+                        char_name = stream.get_image_name_for_expression(stream.current_expression)
+                        displays[i] = stream.compositor.compose(frames[i], stream.current_expression,
+                                                                char_name, stream.load_image(char_name))
+                shown = [d for d in displays if d is not None]
+                if not shown:
+                    break
+                if self.tiled:
+                    tile_canvas = tile_frames(shown, columns, tile_canvas)
+                    outputs = [(self.sinks[0], tile_canvas)]
+                else:
+                    outputs = [(sink, d) for sink, d in zip(self.sinks, displays) if d is not None]
+                if self.hud:
+                    # Over the camera pane of the first stream still shown
+                    first = next(i for i, d in enumerate(displays) if d is not None)
+                    draw_hud(outputs[0][1], self.stats.cached_snapshot(), frames[first].shape[1])
+                compose_done = time.perf_counter()
+
+                for sink, display in outputs:
+                    sink.show(display)
+                show_done = time.perf_counter()
+                keys = [sink.poll_key() for sink in self.sinks]
+                key_done = time.perf_counter()
+                if self.stats is not None:
+                    self.stats.record({
+                        'capture': capture_done - start,
+                        'detect': detect_done - capture_done,
+                        'compose': compose_done - detect_done,
+                        'imshow': show_done - compose_done,
+                        'waitkey': key_done - show_done,
+                    }, key_done, bool(pending))
+                frame_count += 1
+                if ord('q') in keys:
+                    break
+        except KeyboardInterrupt:
+            print("Interrupted")
+
+        if self.batches:
+            print(f"Classified {self.faces_classified} faces in {self.batches} batches "
+                  f"({self.faces_classified / self.batches:.2f} per batch)")
+        print(self.model.summary())
+        if self.result_cache is not None:
+            print(self.result_cache.summary())
+        if self.stats is not None:
+            self.stats.close()
+        for stream in self.streams:
+            if isinstance(stream.source, ThreadedGrabber):
+                print(stream.source.summary())
+            stream.source.release()
+        for sink in self.sinks:
+            sink.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the expression matcher on several frame sources")
+    parser.add_argument('--source', action='append', required=True,
+                        help="frame source, repeat for each stream (see expression_matcher.py --help)")
+    parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--layout', choices=['tiled', 'per-stream'], default='tiled')
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--hud', action='store_true')
+    parser.add_argument('--inference-scale', type=float, default=1.0,
+                        help="find and track faces on a copy downscaled by this factor")
+    parser.add_argument('--stream-port', type=int,
+                        help="serve the output as MJPEG on localhost, per-stream layout uses consecutive ports")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--cache-distance', type=int, default=4,
+                        help="reuse a cached result for faces within this many hash bits, -1 disables the cache")
+    args = parser.parse_args(argv)
+
+    if not Path('images').exists():
+        print("Error: Image directory 'images' not found!")
+        return
+
+    try:
+        sources = [open_source(spec, loop=args.loop) for spec in args.source]
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    result_cache = EmotionResultCache(max_distance=args.cache_distance) if args.cache_distance >= 0 else None
+    matcher = MultiStreamMatcher(sources, model=EmotionModel(backend=args.emotion_backend),
+                                 tiled=args.layout == 'tiled', headless=args.headless,
+                                 max_frames=args.max_frames, result_cache=result_cache,
+                                 stats=StageStats(exporters=[ConsoleExporter()]) if args.headless else None,
+                                 hud=args.hud, stream_port=args.stream_port,
+                                 inference_scale=args.inference_scale)
+    matcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class StageStats:
+    # Rolling per-stage timings over the last `window` frames. Exporters get
+    # a snapshot every export_interval seconds.
+    def __init__(self, window=300, exporters=(), export_interval=2.0):
+        self.window = window
+        self.samples = {}
+        self.frame_times = deque(maxlen=window)
+        self.inference_times = deque(maxlen=window)
+        self.exporters = list(exporters)
+        self.export_interval = export_interval
+        self.last_export = time.perf_counter()
+        self.frames = 0
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_time = 0.0
+
+    def record(self, stage_times, now=None, inferred=False):
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            for stage, seconds in stage_times.items():
+                samples = self.samples.get(stage)
+                if samples is None:
+                    samples = self.samples[stage] = deque(maxlen=self.window)
+                samples.append(seconds)
+            self.frame_times.append(now)
+            if inferred:
+                self.inference_times.append(now)
+            self.frames += 1
+
+        if self.exporters and now - self.last_export >= self.export_interval:
+            self.last_export = now
+            snapshot = self.snapshot()
+            for exporter in self.exporters:
+                exporter.export(snapshot)
+
+    def snapshot(self):
+        with self._lock:
+            frame_times = list(self.frame_times)
+            inference_times = list(self.inference_times)
+            stages = {stage: np.array(samples) for stage, samples in self.samples.items() if samples}
+            frames = self.frames
+
+        span = frame_times[-1] - frame_times[0] if len(frame_times) > 1 else 0.0
+        snapshot = {
+            'time': time.time(),
+            'frames': frames,
+            'fps': (len(frame_times) - 1) / span if span > 0 else 0.0,
+            'inference_rate': len([t for t in inference_times if t >= frame_times[0]]) / span if span > 0 else 0.0,
+            'stages': {},
+        }
+        for stage, samples in stages.items():
+            p50, p99 = np.percentile(samples, [50, 99]) * 1000
+            snapshot['stages'][stage] = {'mean_ms': float(samples.mean() * 1000),
+                                         'p50_ms': float(p50), 'p99_ms': float(p99)}
+        return snapshot
+
+    def cached_snapshot(self, max_age=0.5):
+        # For the HUD, recomputing percentiles every frame is wasted work
+        now = time.perf_counter()
+        if self._snapshot is None or now - self._snapshot_time >= max_age:
+            self._snapshot = self.snapshot()
+            self._snapshot_time = now
+        return self._snapshot
+
+    def close(self):
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            exporter.export(snapshot)
+            exporter.close()
+
+
+def draw_hud(canvas, snapshot, width=None):
+    lines = [f"{snapshot['fps']:.1f} fps  {snapshot['inference_rate']:.1f} inferences/s"]
+    for stage, s in snapshot['stages'].items():
+        lines.append(f"{stage:<9} p50 {s['p50_ms']:6.2f}  p99 {s['p99_ms']:6.2f} ms")
+
+    height = 18 * len(lines) + 10
+    # Stay within the camera pane (width), the compositor doesn't redraw the
+    # character pane every frame, so darkening it would accumulate
+    width = min(330, canvas.shape[1] if width is None else width)
+    panel = canvas[0:height, 0:width]
+    # Darken the corner so the text stays readable on any background
+    panel //= 3
+    for i, line in enumerate(lines):
+        cv2.putText(panel, line, (8, 20 + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                    (0, 255, 0), 1, cv2.LINE_AA)
+
+
+class ConsoleExporter:
+    # How many frames per second each stage could sustain on its own
+    def export(self, snapshot):
+        parts = [f"loop {snapshot['fps']:.1f} fps"]
+        for stage, s in snapshot['stages'].items():
+            rate = 1000 / s['mean_ms'] if s['mean_ms'] > 0 else float('inf')
+            parts.append(f"{stage} {rate:.1f} fps")
+        print(" | ".join(parts))
+
+    def close(self):
+        pass
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def export(self, snapshot):
+        self.file.write(json.dumps(snapshot) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def prometheus_text(snapshot):
+    lines = [
+        '# TYPE expression_matcher_frames_total counter',
+        f"expression_matcher_frames_total {snapshot['frames']}",
+        '# TYPE expression_matcher_fps gauge',
+        f"expression_matcher_fps {snapshot['fps']:.3f}",
+        '# TYPE expression_matcher_inference_rate gauge',
+        f"expression_matcher_inference_rate {snapshot['inference_rate']:.3f}",
+        '# TYPE expression_matcher_stage_seconds summary',
+    ]
+    for stage, s in snapshot['stages'].items():
+        lines.append(f'expression_matcher_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50_ms"] / 1000:.6f}')
+        lines.append(f'expression_matcher_stage_seconds{{stage="{stage}",quantile="0.99"}} {s["p99_ms"] / 1000:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    # Serves /metrics in Prometheus text format on localhost
+    def __init__(self, stats, port=9464, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = prometheus_text(stats.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+        print(f"Metrics on http://{host}:{self.server.server_address[1]}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
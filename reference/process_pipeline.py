@@ -0,0 +1,423 @@
+import argparse
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from async_inference import LatencyTracker
+from expression_matcher import ExpressionMatcher
+from frame_sinks import HeadlessSink, WindowSink
+from perf_stats import ConsoleExporter, StageStats, draw_hud
+
+# Frames live in a ring of slots in one shared memory block. Only slot
+# numbers, timestamps and emotion scores travel through the queues.
+#
+#   capture process   --(slot, seq, ts)-->      renderer (this process)
+#   renderer          --(slot, seq, ts)-->      inference workers
+#   inference workers --(slot, seq, box, ...)--> renderer
+#   renderer          --(free slot)-->          capture process
+#
+# The renderer owns the slot bookkeeping: a slot goes back to the capture
+# process once it has been composited and every worker reading it is done.
+
+
+def _capture_process(spec, loop, source_fps, info, ring_names, free_slots, frames, stop):
+    from frame_sources import open_source
+
+    try:
+        source = open_source(spec, loop=loop)
+    except ValueError as e:
+        info.put(('error', str(e)))
+        return
+    ret, frame = source.read()
+    if not ret:
+        info.put(('error', f"No frames from {spec}"))
+        source.release()
+        return
+    info.put(('shape', frame.shape))
+
+    name, slots = ring_names.get()
+    shm = shared_memory.SharedMemory(name=name)
+    ring = np.ndarray((slots,) + frame.shape, dtype=np.uint8, buffer=shm.buf)
+    # A camera keeps going and frames with no free slot are dropped, the
+    # renderer would only want newer ones anyway. Files wait for a slot.
+    live = spec.startswith('camera')
+    grabbed = dropped = 0
+    seq = 0
+    next_time = time.perf_counter()
+    try:
+        while ret and not stop.is_set():
+            grabbed += 1
+            slot = None
+            while slot is None and not stop.is_set():
+                try:
+                    slot = free_slots.get_nowait() if live else free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    if live:
+                        dropped += 1
+                        break
+            if slot is not None:
+                if frame.shape == ring.shape[1:]:
+                    ring[slot] = frame
+                else:
+                    ring[slot] = cv2.resize(frame, (ring.shape[2], ring.shape[1]))
+                seq += 1
+                # perf_counter is CLOCK_MONOTONIC on Linux, comparable across processes
+                frames.put((slot, seq, time.perf_counter()))
+            if source_fps:
+                # Play files back at camera speed
+                next_time += 1 / source_fps
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+            ret, frame = source.read()
+    finally:
+        frames.put(('end', grabbed, dropped))
+        source.release()
+        del ring
+        shm.close()
+
+
+def _inference_worker(index, name, shape, slots, jobs, results, backend, inference_scale, worker_init):
+    if worker_init is not None:
+        worker_init()
+    # One OpenCV thread per worker, the workers themselves are the parallelism
+    cv2.setNumThreads(1)
+    from emotion_model import EmotionModel
+    from face_tracker import FaceTracker
+
+    shm = shared_memory.SharedMemory(name=name)
+    ring = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        model = EmotionModel(backend=backend)
+    except Exception as e:
+        results.put(('error', index, str(e)))
+        model = None
+    else:
+        results.put(('ready', index, model.summary()))
+
+    # Frames are spread over the workers, so every frame gets a full detection
+    tracker = FaceTracker(detect_scale=inference_scale)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            slot, seq, timestamp = job
+            box = tracker.locate(ring[slot]) if model is not None else None
+            scores = None
+            if box is not None:
+                face = tracker.crop(ring[slot], box)
+                scores = model.scores([face])[0]
+            results.put(('result', slot, seq, timestamp, box, scores))
+    finally:
+        if model is not None:
+            results.put(('summary', index, model.summary()))
+        del ring
+        shm.close()
+
+
+class RingSource:
+    # Stand-in source for the renderer's ExpressionMatcher, frames come from the ring
+    def read(self):
+        return False, None
+
+    def release(self):
+        pass
+
+
+class ProcessPipeline:
+    def __init__(self, source_spec, workers=2, slots=None, loop=False, source_fps=None, backend='keras',
+                 inference_scale=1.0, expression_mapping_file='expressions.json', image_directory='images',
+                 sink=None, max_frames=None, stats=None, hud=False, worker_init=None):
+        self.source_spec = source_spec
+        self.workers = workers
+        # Enough slots for one frame per busy worker plus the renderer and capture
+        self.slots = slots or 2 * workers + 4
+        self.loop = loop
+        self.source_fps = source_fps
+        self.backend = backend
+        self.inference_scale = inference_scale
+        self.worker_init = worker_init
+        self.max_frames = max_frames
+        self.matcher = ExpressionMatcher(expression_mapping_file, image_directory, source=RingSource(),
+                                         sink=sink if sink is not None else WindowSink(), load_model=False)
+        self.stats = stats if stats is not None or not hud else StageStats()
+        self.hud = hud
+        self.latency = LatencyTracker()
+        self.refs = [0] * self.slots
+        self.ready = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.last_seq = 0
+        self.frames = 0
+        self.skipped = 0
+        self.jobs_sent = 0
+        self.results = 0
+        # Results for frames with a face, the only ones the model ran on
+        self.scored = 0
+        self.capture_counts = None
+        self.worker_summaries = {}
+
+    def release_slot(self, slot):
+        self.refs[slot] -= 1
+        if self.refs[slot] == 0:
+            self.free_slots.put(slot)
+
+    def next_frame(self):
+        # Newest waiting frame, older ones are released unseen
+        message = self.frame_queue.get()
+        while True:
+            if message[0] == 'end':
+                self.capture_counts = message[1:]
+                return None
+            try:
+                newer = self.frame_queue.get_nowait()
+            except queue.Empty:
+                return message
+            self.refs[message[0]] += 1
+            self.release_slot(message[0])
+            self.skipped += 1
+            message = newer
+
+    def poll_results(self):
+        inferred = False
+        while True:
+            try:
+                message = self.result_queue.get_nowait()
+            except queue.Empty:
+                return inferred
+            kind = message[0]
+            if kind == 'ready':
+                self.ready += 1
+                print(f"Worker {message[1]}: {message[2]}")
+            elif kind == 'error':
+                self.failed += 1
+                print(f"Error: Worker {message[1]} could not load the emotion model: {message[2]}")
+            elif kind == 'summary':
+                self.worker_summaries[message[1]] = message[2]
+            else:
+                _, slot, seq, timestamp, box, scores = message
+                self.release_slot(slot)
+                self.in_flight -= 1
+                self.results += 1
+                if scores is not None:
+                    self.scored += 1
+                # Workers finish out of order, an older frame's result is stale
+                if seq > self.last_seq and scores is not None:
+                    self.last_seq = seq
+                    self.matcher.apply_scores(scores, timestamp)
+                    self.latency.record(timestamp)
+                    if self.matcher.first_detection is None:
+                        self.matcher.first_detection = time.perf_counter() - self.matcher.start_time
+                        print(f"First detection {self.matcher.first_detection:.2f} s after start")
+                inferred = True
+
+    def status_text(self):
+        if self.matcher.first_detection is not None:
+            return None
+        if self.failed == self.workers:
+            return "Emotion model unavailable"
+        return "Warming up..."
+
+    def start(self):
+        context = mp.get_context('spawn')
+        self.stop_event = context.Event()
+        info = context.Queue()
+        ring_names = context.Queue()
+        self.free_slots = context.Queue()
+        self.frame_queue = context.Queue()
+        self.job_queue = context.Queue()
+        self.result_queue = context.Queue()
+
+        self.capture = context.Process(target=_capture_process, name='capture', daemon=True,
+                                       args=(self.source_spec, self.loop, self.source_fps, info,
+                                             ring_names, self.free_slots, self.frame_queue,
+                                             self.stop_event))
+        self.capture.start()
+        while True:
+            try:
+                kind, value = info.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if not self.capture.is_alive():
+                    raise ValueError("The capture process exited before its first frame")
+        if kind == 'error':
+            self.capture.join()
+            raise ValueError(value)
+
+        shape = tuple(value)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * int(np.prod(shape)))
+        self.ring = np.ndarray((self.slots,) + shape, dtype=np.uint8, buffer=self.shm.buf)
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        ring_names.put((self.shm.name, self.slots))
+        print(f"Frame ring: {self.slots} slots of {shape[1]}x{shape[0]}, "
+              f"{self.shm.size / 2 ** 20:.1f} MiB shared memory")
+
+        self.worker_processes = [
+            context.Process(target=_inference_worker, name=f'inference-{i}', daemon=True,
+                            args=(i, self.shm.name, shape, self.slots, self.job_queue, self.result_queue,
+                                  self.backend, self.inference_scale, self.worker_init))
+            for i in range(self.workers)]
+        for process in self.worker_processes:
+            process.start()
+
+        # Files and synthetic frames aren't live, so nothing is lost by
+        # waiting for the models instead of racing through the first frames
+        if not self.source_spec.startswith('camera'):
+            while self.ready + self.failed < self.workers and any(p.is_alive() for p in self.worker_processes):
+                self.poll_results()
+                time.sleep(0.01)
+
+    def run(self):
+        self.start()
+        start_time = time.perf_counter()
+        try:
+            self.loop_frames()
+        finally:
+            self.shutdown()
+        self.elapsed = time.perf_counter() - start_time
+        self.report()
+
+    def loop_frames(self):
+        matcher = self.matcher
+        while self.max_frames is None or self.frames < self.max_frames:
+            start = time.perf_counter()
+            message = self.next_frame()
+            if message is None:
+                break
+            slot, seq, timestamp = message
+            self.refs[slot] += 1
+            received = time.perf_counter()
+
+            inferred = self.poll_results()
+            # Hand the newest frame to a worker whenever one is free
+            if self.in_flight < self.ready:
+                self.refs[slot] += 1
+                self.in_flight += 1
+                self.jobs_sent += 1
+                self.job_queue.put((slot, seq, timestamp))
+            dispatched = time.perf_counter()
+
+            char_name = matcher.get_image_name_for_expression(matcher.current_expression)
+            display_frame = matcher.compositor.compose(self.ring[slot], matcher.current_expression, char_name,
+                                                       matcher.load_image(char_name), status=self.status_text())
+            # The compositor copied the frame, the slot can be reused
+            self.release_slot(slot)
+            if self.hud:
+                draw_hud(display_frame, self.stats.cached_snapshot(), self.ring.shape[2])
+            composed = time.perf_counter()
+
+            matcher.sink.show(display_frame)
+            shown = time.perf_counter()
+            key = matcher.sink.poll_key()
+            key_done = time.perf_counter()
+            self.frames += 1
+            if self.stats is not None:
+                self.stats.record({
+                    'capture': received - start,
+                    'results': dispatched - received,
+                    'compose': composed - dispatched,
+                    'imshow': shown - composed,
+                    'waitkey': key_done - shown,
+                }, key_done, inferred)
+            if key == ord('q'):
+                break
+
+    def shutdown(self):
+        self.stop_event.set()
+        for _ in self.worker_processes:
+            self.job_queue.put(None)
+
+        # Keep draining so no process blocks on a full queue while exiting
+        deadline = time.perf_counter() + 10
+        while time.perf_counter() < deadline:
+            self.poll_results()
+            if self.capture_counts is None:
+                self.next_frame_nowait()
+            if not any(p.is_alive() for p in self.worker_processes + [self.capture]):
+                break
+            time.sleep(0.01)
+        self.poll_results()
+        for process in self.worker_processes + [self.capture]:
+            if process.is_alive():
+                print(f"{process.name} did not stop, terminating it")
+                process.terminate()
+            process.join()
+
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+    def next_frame_nowait(self):
+        while True:
+            try:
+                message = self.frame_queue.get_nowait()
+            except queue.Empty:
+                return
+            if message[0] == 'end':
+                self.capture_counts = message[1:]
+
+    def report(self):
+        matcher = self.matcher
+        fps = self.frames / self.elapsed if self.elapsed else 0.0
+        print(f"Rendered {self.frames} frames in {self.elapsed:.1f} s ({fps:.1f} fps), "
+              f"{self.skipped} skipped as stale")
+        if self.capture_counts is not None:
+            grabbed, dropped = self.capture_counts
+            print(f"Capture: {grabbed} frames grabbed, {dropped} dropped with no free slot")
+        print(f"Inference: {self.jobs_sent} frames sent to {self.workers} worker(s), {self.results} results, "
+              f"{self.scored} with a face ({self.scored / self.elapsed if self.elapsed else 0.0:.1f} per second)")
+        stats = self.latency.summary()
+        if stats is not None:
+            print(f"Capture to result latency over {stats['count']} results: mean {stats['mean_ms']:.1f} ms, "
+                  f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms")
+        for index, summary in sorted(self.worker_summaries.items()):
+            print(f"Worker {index}: {summary}")
+        print(matcher.smoother.summary())
+        if self.stats is not None:
+            self.stats.close()
+        matcher.sink.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run capture, inference and rendering in separate processes")
+    parser.add_argument('--source', default='camera:0',
+                        help="camera[:index], synthetic[:WxH[:count]], a video file or an image directory")
+    parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--source-fps', type=float, default=None,
+                        help="play video files and image directories back at this frame rate")
+    parser.add_argument('--workers', type=int, default=2, help="inference worker processes")
+    parser.add_argument('--slots', type=int, default=None,
+                        help="frames in the shared memory ring, default 2 per worker plus 4")
+    parser.add_argument('--emotion-backend', choices=['keras', 'onnx', 'tflite'], default='keras')
+    parser.add_argument('--inference-scale', type=float, default=1.0)
+    parser.add_argument('--headless', action='store_true')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--hud', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not Path('images').exists():
+        print("Error: Image directory 'images' not found!")
+        return
+
+    pipeline = ProcessPipeline(args.source, workers=args.workers, slots=args.slots, loop=args.loop,
+                               source_fps=args.source_fps,
+                               backend=args.emotion_backend, inference_scale=args.inference_scale,
+                               sink=HeadlessSink() if args.headless else WindowSink(),
+                               max_frames=args.max_frames, hud=args.hud,
+                               stats=StageStats(exporters=[ConsoleExporter()]) if args.headless else None)
+    try:
+        pipeline.run()
+    except ValueError as e:
+        print(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
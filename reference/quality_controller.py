@@ -0,0 +1,127 @@
+import json
+import time
+
+KNOBS = ['analysis_interval_ms', 'inference_scale', 'display_scale']
+
+
+class QualityController:
+    # Holds the loop at target_fps on a shared CPU. Every adjust_every seconds
+    # it looks at the measured frame rate, how much of each frame's time budget
+    # the loop was busy, and how much CPU went to inference. When the loop is
+    # behind it lowers one quality knob, when there is headroom it restores one.
+    # Knobs start at their best value and never leave their bounds:
+    #   analysis_interval_ms  (best, worst)  longer means fewer model calls
+    #   inference_scale       (worst, best)  face finding on a smaller copy
+    #   display_scale         (worst, best)  compose and show a smaller frame
+    def __init__(self, target_fps=30.0, interval_ms=(100, 1000), inference_scale=(0.25, 1.0),
+                 display_scale=(0.5, 1.0), adjust_every=1.0, cooldown=2.0, tolerance=0.1,
+                 log_path=None):
+        self.target_fps = target_fps
+        interval_ms = (round(interval_ms[0]), round(interval_ms[1]))
+        self.bounds = {
+            'analysis_interval_ms': interval_ms,
+            'inference_scale': inference_scale,
+            'display_scale': display_scale,
+        }
+        self.settings = {
+            'analysis_interval_ms': interval_ms[0],
+            'inference_scale': inference_scale[1],
+            'display_scale': display_scale[1],
+        }
+        self.adjust_every = adjust_every
+        self.cooldown = cooldown
+        self.tolerance = tolerance
+        self.log_file = open(log_path, 'a') if log_path else None
+        self.adjustments = []
+        self.window_start = None
+        self.last_change = None
+        self.last_restore = None
+        self.restore_cooldown = cooldown
+        self._reset_window(None)
+
+    def _reset_window(self, now):
+        self.window_start = now
+        self.frames = 0
+        self.busy = 0.0
+        self.inference = 0.0
+        self.inferences = 0
+
+    def update(self, now, busy_seconds, inference_seconds=None):
+        # Called once per frame. Returns the changed settings, or None
+        if self.window_start is None:
+            self._reset_window(now)
+            return None
+        self.frames += 1
+        self.busy += busy_seconds
+        if inference_seconds is not None:
+            self.inference += inference_seconds
+            self.inferences += 1
+
+        elapsed = now - self.window_start
+        if elapsed < self.adjust_every:
+            return None
+        fps = self.frames / elapsed
+        # Share of the per-frame budget the loop spent working rather than
+        # waiting for the camera, above 1 means the target can't be reached
+        utilization = (self.busy / self.frames) * self.target_fps if self.frames else 0.0
+        inference_load = self.inference / elapsed
+        inference_ms = 1000 * self.inference / self.inferences if self.inferences else None
+        self._reset_window(now)
+        if self.last_change is not None and now - self.last_change < self.cooldown:
+            return None
+
+        change = None
+        if fps < self.target_fps * (1 - self.tolerance) and utilization > 1 - self.tolerance:
+            # Inference knobs first, unless inference hardly costs anything
+            order = KNOBS if inference_load >= 0.1 else ['display_scale'] + KNOBS[:2]
+            change = self._step(order, degrade=True)
+            reason = 'behind'
+            # Undoing the last restore means it was too eager, wait longer next time
+            if change is not None and self.last_restore is not None and change[0] == self.last_restore[0]:
+                self.restore_cooldown = min(60.0, self.restore_cooldown * 2)
+            self.last_restore = None
+        elif utilization < 0.6 and (self.last_change is None or now - self.last_change >= self.restore_cooldown):
+            change = self._step(['display_scale', 'inference_scale', 'analysis_interval_ms'], degrade=False)
+            reason = 'headroom'
+            self.last_restore = change
+        if change is None:
+            return None
+
+        knob, old, new = change
+        self.settings[knob] = new
+        self.last_change = now
+        self.log({'time': time.time(), 'reason': reason, 'fps': round(fps, 2),
+                  'utilization': round(utilization, 3),
+                  'inference_ms': round(inference_ms, 2) if inference_ms is not None else None,
+                  'knob': knob, 'old': old, 'new': new})
+        return {knob: new}
+
+    def _step(self, order, degrade):
+        for knob in order:
+            value = self.settings[knob]
+            low, high = self.bounds[knob]
+            if knob == 'analysis_interval_ms':
+                new = min(high, round(value * 1.5)) if degrade else max(low, round(value / 1.5))
+            else:
+                new = max(low, round(value * 0.8, 2)) if degrade else min(high, round(value / 0.8, 2))
+            if new != value:
+                return knob, value, new
+        return None
+
+    def log(self, entry):
+        self.adjustments.append(entry)
+        inference = f", inference {entry['inference_ms']:.1f} ms" if entry['inference_ms'] else ''
+        print(f"Quality: {entry['fps']:.1f} fps, {entry['utilization']:.0%} busy{inference} "
+              f"({entry['reason']}): {entry['knob']} {entry['old']} -> {entry['new']}")
+        if self.log_file is not None:
+            self.log_file.write(json.dumps(entry) + '\n')
+            self.log_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def summary(self):
+        settings = ', '.join(f"{knob} {value}" for knob, value in self.settings.items())
+        return f"Quality control: {len(self.adjustments)} adjustments, ended at {settings}"
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import Counter, OrderedDict
+
+import cv2
+import numpy as np
+
+
+def perceptual_hash(face):
+    # 64-bit pHash: low 8x8 DCT frequencies of a 32x32 grayscale copy against their median
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class EmotionResultCache:
+    # Bounded LRU of emotion scores keyed by face hash. A lookup hits when a
+    # stored hash is within max_distance bits and younger than ttl_seconds.
+    def __init__(self, max_entries=256, max_distance=4, ttl_seconds=3.0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        # Distance to the nearest live entry on every lookup, to tune max_distance
+        self.nearest_distances = Counter()
+
+    def lookup(self, key, now=None):
+        now = time.perf_counter() if now is None else now
+        best_key, best_distance = None, None
+        for stored_key, (_, stored_at) in list(self.entries.items()):
+            if now - stored_at > self.ttl:
+                del self.entries[stored_key]
+                self.expired += 1
+                continue
+            distance = (stored_key ^ key).bit_count()
+            if best_distance is None or distance < best_distance:
+                best_key, best_distance = stored_key, distance
+
+        if best_distance is not None:
+            self.nearest_distances[best_distance] += 1
+        if best_distance is None or best_distance > self.max_distance:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(best_key)
+        return self.entries[best_key][0]
+
+    def store(self, key, scores, now=None):
+        now = time.perf_counter() if now is None else now
+        self.entries[key] = (scores, now)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'nearest_distances': dict(sorted(self.nearest_distances.items())),
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Result cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%} hit rate), nearest distances {stats['nearest_distances']}")
+
+
+def content_hash(path, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImageResultStore:
+    # Still-image results in SQLite, keyed by the SHA-256 of the file contents
+    # and the settings that produced them. Unchanged files are found again
+    # after a rename or copy, edited files get a new key.
+    def __init__(self, path='image_results.sqlite'):
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'content_hash TEXT NOT NULL, settings TEXT NOT NULL, result TEXT NOT NULL, '
+                        'created REAL NOT NULL, PRIMARY KEY (content_hash, settings))')
+        self.db.commit()
+        self.hits = 0
+        self.stored = 0
+
+    def lookup(self, hashes, settings):
+        # hash -> stored result for every hash that has one
+        found = {}
+        hashes = list(hashes)
+        # SQLite caps the number of query parameters
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = self.db.execute(f"SELECT content_hash, result FROM results WHERE settings = ? "
+                                   f"AND content_hash IN ({', '.join('?' * len(chunk))})", [settings, *chunk])
+            for key, result in rows:
+                found[key] = json.loads(result)
+        self.hits += len(found)
+        return found
+
+    def store(self, results, settings):
+        # One transaction per call, so an interrupted run keeps what it finished
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                [(key, settings, json.dumps(result), now) for key, result in results.items()])
+        self.stored += len(results)
+
+    def close(self):
+        self.db.close()
+
+    def summary(self):
+        return f"Image result store {self.path}: {self.hits} hits, {self.stored} new results"
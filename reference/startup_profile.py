@@ -0,0 +1,47 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    # Milestones on the main thread are timed from the previous milestone,
+    # stages (which may run on other threads) report their own duration
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_mark = self.start
+        self.milestones = []
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def mark(self, label):
+        now = time.perf_counter()
+        with self._lock:
+            if any(existing == label for existing, _, _ in self.milestones):
+                return
+            self.milestones.append((label, now - self.last_mark, now - self.start))
+            self.last_mark = now
+
+    @contextmanager
+    def stage(self, label):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.stages.append((label, end - begin, end - self.start))
+
+    def report(self):
+        with self._lock:
+            milestones = list(self.milestones)
+            stages = list(self.stages)
+        print("\nStartup profile (seconds since the first application import):")
+        for label, took, at in milestones:
+            print(f"  {label:<40} +{took:7.3f} s  at {at:7.3f} s")
+        if stages:
+            print("Background stages:")
+            for label, took, at in stages:
+                print(f"  {label:<40} {took:8.3f} s  done at {at:7.3f} s")
+
+
+startup = StartupProfile()